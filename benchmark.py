@@ -0,0 +1,59 @@
+"""
+"""
+import argparse
+import glob
+import os
+import sys
+from martiandtrump import benchmark, utils, vocabulary
+
+
+CONFIG_FILE = 'config.ini'
+CONSOLE_FORMAT = '%(levelname)s %(message)s'
+RESULTS_DIR = 'benchmarks'
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+
+
+if __name__ == '__main__':
+
+    # Read the options for this benchmark run.
+    parser = argparse.ArgumentParser(prog=SCRIPT_NAME)
+    parser.add_argument('--count', type=int, default=1000,
+                        help='synthetic tweets in the corpus')
+    parser.add_argument('--seed', type=int, default=1,
+                        help='random seed used to generate the corpus')
+    parser.add_argument('--repeat', type=int, default=3,
+                        help='times each function is run over the corpus')
+    parser.add_argument('--results', default=RESULTS_DIR,
+                        help='directory where JSON results are saved')
+    parser.add_argument('--compare', default=None,
+                        help='results to compare with, defaults to the latest')
+    parser.add_argument('--tolerance', type=float, default=0.2,
+                        help='p50 slowdown reported as a regression')
+    options = parser.parse_args()
+
+    # Only report problems, so logging doesn't distort the timings.
+    handlers = [('console', 'ERROR', CONSOLE_FORMAT)]
+    log, _ = utils.log_setup(SCRIPT_NAME, handlers)
+
+    # Find the latest previous results before this run adds to them.
+    previous = options.compare
+    if previous is None:
+        pattern = os.path.join(SCRIPT_DIR, options.results, 'benchmark.*.json')
+        found = sorted(glob.glob(pattern))
+        previous = found[-1] if found else None
+
+    # Run the benchmarks, save the results and compare them with the last.
+    vocab = vocabulary.vocab_load(os.path.join(SCRIPT_DIR, CONFIG_FILE))
+    results = benchmark.benchmark_run(vocab, options.count, options.seed,
+                                      options.repeat)
+    path = benchmark.benchmark_save(results, options.results)
+    regressions = []
+    if previous:
+        previous = benchmark.benchmark_load(previous)
+    if previous and previous.get('count') == results['count'] \
+            and previous.get('seed') == results['seed']:
+        regressions = benchmark.benchmark_compare(results, previous,
+                                                  options.tolerance)
+    print(benchmark.benchmark_report(results, regressions))
+    print('Results saved to ' + path)
+    sys.exit(1 if regressions else 0)
@@ -4,11 +4,13 @@ import logging
 import os
 import sys
 from martiandtrump import config, streamer, system, translator, twitter, utils
+from martiandtrump import bulk, daemon, sources, translations, vocabulary
 
 
 CONFIG_FILE = 'config.ini'
 CONSOLE_FORMAT = '%(levelname)s %(message)s'
 LOG_FORMAT = '%(asctime)s | %(name)s | %(levelname)s | %(message)s'
+LOG_LEVEL = 'INFO'
 LOG_TYPE = 'log'
 SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
 TIME_FORMAT = '%Y-%m-%d %H-%M-%S,%f'
@@ -18,38 +20,70 @@ if __name__ == '__main__':
 
     # Load the config settings.
     config_path = os.path.join(SCRIPT_DIR, CONFIG_FILE)
-    config_dict = config.config_load(config_path)
+    config_dict = config.config_load(config_path, exclude=['vocab'])
 
     # Configure and start logging.
     log_dir = config.config_default(config_dict, 'logs', 'directory',
                                     SCRIPT_DIR)
     log_dir = system.dir_check(log_dir, SCRIPT_DIR)
     log_type = config.config_default(config_dict, 'logs', 'type', LOG_TYPE)
+    log_level = config.config_default(config_dict, 'logs', 'level', LOG_LEVEL)
+    log_level = log_level.upper()
     log_file = '.'.join([SCRIPT_NAME, utils.text_time(TIME_FORMAT), log_type])
     log_path = os.path.join(log_dir, log_file)
     handlers = [
         ('console', 'WARN', CONSOLE_FORMAT),
         ('stream', 'WARN', None),
-        (log_path, 'INFO', LOG_FORMAT),
+        (log_path, log_level, LOG_FORMAT),
     ]
     log, problems = utils.log_setup(SCRIPT_NAME, handlers)
     log.info('Logging to ' + ', '.join([name for name, _, _ in handlers]))
 
+    # Translate a file of archived tweet records in bulk.
+    daemonize = sys.argv[1:] == ['--daemon']
+    result = True
+    if bulk.bulk_requested(sys.argv[1:]):
+        options = bulk.bulk_options(sys.argv[1:])
+        records, took, rate = bulk.bulk_translate(
+            config_path, options.batch, options.out, options.workers,
+            options.chunk)
+        print('{} records translated at {:.0f}/sec'.format(records, rate))
+
     # Perform a straight command-line translation on any arguments.
-    if len(sys.argv) > 1:
+    elif len(sys.argv) > 1 and not daemonize:
         text = ' '.join(sys.argv[1:])
-        vocab = config_dict['vocab'] if 'vocab' in config_dict else {}
+        vocab = vocabulary.vocab_load(config_path)
         result = translator.translate(text, vocab)
         print(result)
     
-    # Run as a realtime twitter translator if no arguments have been supplied.
+    # Run as a realtime twitter translator if no arguments have been supplied,
+    # or keep running it as a daemon reconnecting whenever the stream drops.
     elif system.lock(SCRIPT_NAME):
         source_id = config_dict['source']['id']
         account = dict(config_dict['account'])
         listener = dict(config_dict['listener'])
-        vocab = dict(config_dict['vocab'])
-        result = streamer.start(source_id, account, listener, vocab)
+        vocab = vocabulary.vocab_load(config_path)
+        remember = config.config_default(config_dict, 'cache', 'translations')
+        results = None
+        if remember and int(remember) > 0:
+            results = translations.TranslationCache(size=int(remember))
+        stages = dict(config_dict['pipeline']) if 'pipeline' in config_dict \
+            else {}
+        limits = dict(config_dict['limits']) if 'limits' in config_dict \
+            else {}
+        others = sources.sources_load(config_dict, vocab)
+        supervisor = None
+        if daemonize:
+            restarts = dict(config_dict['daemon']) if 'daemon' in config_dict \
+                else {}
+            supervisor = daemon.StreamSupervisor(**restarts)
+        result = streamer.start(source_id, account, listener, vocab, results,
+                                stages, limits, others, supervisor)
         system.lock_break(SCRIPT_NAME)
 
     # Clean up diagnostically-boring log files.
     utils.log_cleanup(log_path, problems, log)
+
+    # Let a service manager know the daemon failed, so it can be restarted.
+    if daemonize and not result:
+        sys.exit(1)
@@ -0,0 +1,311 @@
+"""
+"""
+import json
+import logging
+import os
+import platform
+import random
+import string
+import time
+from martiandtrump import numeric, resolver, system, translator, twitter
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+benchmark_log = logging.getLogger(SCRIPT_NAME + '.benchmark')
+
+# Kinds of synthetic tweet in the corpus, and how often each turns up.
+CORPUS_KINDS = [
+    ('short', 4),
+    ('extended', 3),
+    ('urls', 2),
+    ('repetitive', 1),
+]
+CORPUS_PUNCTUATION = ['!', '!!', '.', ',', '?', '...', ':', '"']
+
+# Words in each pathologically repetitive text, like "ack ack ack ...".
+RUNS_WORDS = [1000, 2000, 4000, 8000]
+LOG_FORMAT = '%(asctime)s | %(name)s | %(levelname)s | %(message)s'
+PERCENTILES = [50, 90, 99]
+
+
+def benchmark_compare(results, previous, tolerance=0.2):
+    """Return descriptions of functions slower than a previous run."""
+    regressions = []
+    for name, stats in sorted(results['functions'].items()):
+        before = previous.get('functions', {}).get(name)
+        if not before or not before.get('p50'):
+            continue
+        change = stats['p50'] / before['p50'] - 1
+        if change > tolerance:
+            message = '{} p50 {:.1f}us -> {:.1f}us ({:+.0%})'
+            message = message.format(name, before['p50'], stats['p50'], change)
+            regressions.append(message)
+    return regressions
+
+
+def benchmark_commit():
+    """Return the git commit being benchmarked, if there is one."""
+    command = 'git -C "' + SCRIPT_DIR + '" rev-parse --short HEAD'
+    exit_code, output, _ = system.command_run(command)
+    return output if exit_code == 0 else None
+
+
+def benchmark_corpus(vocab, count=1000, seed=1):
+    """Return a reproducible list of synthetic tweets of assorted kinds."""
+    rng = random.Random(seed)
+    words = sorted(vocab)
+    kinds = [kind for kind, weight in CORPUS_KINDS for _ in range(weight)]
+    corpus = []
+    for idx in range(count):
+        kind = kinds[idx % len(kinds)]
+
+        # Build each kind of tweet from vocab, made-up words, and extras.
+        if kind == 'repetitive':
+            phrase = range(rng.randint(1, 3))
+            phrase = [corpus_word(rng, words) for _ in phrase]
+            text = ' '.join(phrase * rng.randint(30, 80))
+        else:
+            size = 280 if kind == 'extended' else rng.randint(40, 140)
+            text = corpus_text(rng, words, size, kind == 'urls')
+        corpus.append({
+            'kind': kind,
+            'payload': corpus_payload(rng, idx, text),
+            'text': text,
+        })
+    return corpus
+
+
+def benchmark_function(function, inputs, repeat=1):
+    """Time a function on each input, returning timings in microseconds."""
+    timings = []
+    for _ in range(repeat):
+        for arguments, fresh in inputs:
+            arguments = fresh(arguments) if fresh else arguments
+            began = time.perf_counter_ns()
+            function(*arguments)
+            timings.append((time.perf_counter_ns() - began) / 1000)
+    return timings
+
+
+def benchmark_load(path):
+    """Return previously saved benchmark results, or None."""
+    try:
+        with open(path) as handle:
+            return json.load(handle)
+    except (OSError, ValueError) as e:
+        benchmark_log.warn('Benchmark results unreadable: ' + str(e))
+        return None
+
+
+def benchmark_logging(vocab, texts, links):
+    """Return microseconds a tweet takes to translate with debug off and on."""
+    log = logging.getLogger(SCRIPT_NAME)
+    handler = logging.FileHandler(os.devnull)
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    level = log.level
+    log.addHandler(handler)
+
+    # Log to nowhere, so only building and formatting messages is timed.
+    took = {}
+    try:
+        for name, setting in [('off', logging.INFO), ('on', logging.DEBUG)]:
+            log.setLevel(setting)
+            engine = translator.TranslationEngine(vocab, links=links)
+            began = time.perf_counter()
+            _ = [translator.translate(x, vocab, 280, engine) for x in texts]
+            took[name] = (time.perf_counter() - began) / len(texts) * 1e6
+    finally:
+        log.setLevel(level)
+        log.removeHandler(handler)
+        handler.close()
+    return took
+
+
+def benchmark_report(results, regressions=[]):
+    """Return a printable table of benchmark results."""
+    columns = ['p' + str(x) for x in PERCENTILES] + ['max', 'mean']
+    lines = ['{:<20}{:>8}'.format('function (us)', 'calls')]
+    lines[0] += ''.join('{:>10}'.format(x) for x in columns)
+    for name, stats in sorted(results['functions'].items()):
+        line = '{:<20}{:>8}'.format(name, stats['calls'])
+        line += ''.join('{:>10.1f}'.format(stats[x]) for x in columns)
+        lines.append(line)
+    message = 'translate: {:.0f} tweets/sec, translate_many: {:.0f} tweets/sec'
+    lines.append(message.format(results['tweets_per_sec']['translate'],
+                                results['tweets_per_sec']['translate_many']))
+    rates = results.get('words_per_sec', {})
+    lines.append(', '.join('{}: {:.0f} words/sec'.format(k, v)
+                           for k, v in sorted(rates.items())))
+    message = 'translate with debug logging off: {:.0f}us/tweet, on: ' + \
+        '{:.0f}us/tweet'
+    lines.append(message.format(results['debug_logging']['off'],
+                                results['debug_logging']['on']))
+    lines.extend(['Regression: ' + x for x in regressions])
+    return '\n'.join(lines)
+
+
+def benchmark_run(vocab, count=1000, seed=1, repeat=3):
+    """Benchmark the translation and parsing hot paths on a corpus."""
+    benchmark_log.info('Benchmarking {} tweets, seed {}'.format(count, seed))
+    corpus = benchmark_corpus(vocab, count, seed)
+    texts = [x['text'] for x in corpus]
+
+    # Links resolve from a pre-filled cache, the network isn't benchmarked.
+    links = resolver.URLResolver(size=count * 8)
+    for text in texts:
+        for token in translator.tokenize(text):
+            if token.startswith('https://'):
+                links.remember(token, token)
+    engine = translator.TranslationEngine(vocab, links=links)
+
+    # Translating passes each get an engine of their own, starting cold.
+    def cold():
+        return translator.TranslationEngine(vocab, links=links)
+
+    # Prepare inputs for each stage exactly as translate() would see them.
+    tokens = [translator.tokenize(x.replace('http', ' http')) for x in texts]
+    changes = [translator.translate_unique(set(x), engine) for x in tokens]
+    translated = [[c.get(x, x) for x in t] for t, c in zip(tokens, changes)]
+    words = [x for t in tokens for x in t if not x.isspace()]
+    words = random.Random(seed).sample(words, min(len(words), count * 4))
+    unique = sorted(set(x for t in tokens for x in t if not x.isspace()))
+    passes = [(cold(), cold()) for _ in range(repeat)]
+    runs = [translator.tokenize(' '.join(['ack'] * x)) for x in RUNS_WORDS]
+
+    # Time each function, copying any token lists they change in place.
+    timings = {
+        'deduplicate_tokens': benchmark_function(
+            translator.deduplicate_tokens,
+            [((x, 280), corpus_copy) for x in translated], repeat),
+        'deduplicate_runs': benchmark_function(
+            translator.deduplicate_tokens,
+            [((x, 280), corpus_copy) for x in runs], repeat),
+        'delete_tokens': benchmark_function(
+            translator.delete_tokens,
+            [((translator.deduplicate_tokens(list(x), 280), 280, c),
+              corpus_copy) for x, c in zip(translated, changes)], repeat),
+        'syllables': benchmark_function(
+            translator.syllables, [((x,), None) for x in words], repeat),
+        'tokenize': benchmark_function(
+            translator.tokenize, [((x,), None) for x in texts], repeat),
+        'translate': benchmark_function(
+            translator.translate,
+            [((x, vocab, 280, e), None) for e, _ in passes for x in texts]),
+        'translate_token': benchmark_function(
+            translator.translate_token,
+            [((x, vocab, e), None) for _, e in passes for x in unique]),
+        'twitter.parse': benchmark_function(
+            twitter.parse, [((x['payload'],), None) for x in corpus], repeat),
+    }
+
+    # Measure overall throughput, one tweet at a time and all at once.
+    one, batch = cold(), cold()
+    began = time.perf_counter()
+    _ = [translator.translate(x, vocab, 280, one) for x in texts]
+    single = count / (time.perf_counter() - began)
+    began = time.perf_counter()
+    _ = list(translator.translate_many(texts, engine=batch))
+    many = count / (time.perf_counter() - began)
+    logged = benchmark_logging(vocab, texts, links)
+    links.close()
+
+    # Count syllables a word at a time, and all at once if NumPy's there.
+    began = time.perf_counter()
+    _ = [translator.syllables(x) for x in words]
+    rates = {'syllables': len(words) / (time.perf_counter() - began)}
+    if numeric.numpy is not None:
+        began = time.perf_counter()
+        _ = numeric.syllables_array(words)
+        rates['syllables_array'] = len(words) / (time.perf_counter() - began)
+
+    # Summarise the run with enough context to compare it with others.
+    return {
+        'commit': benchmark_commit(),
+        'count': count,
+        'debug_logging': logged,
+        'functions': {k: benchmark_stats(v) for k, v in timings.items()},
+        'platform': platform.platform(),
+        'python': platform.python_version(),
+        'repeat': repeat,
+        'seed': seed,
+        'time': utils.text_time(),
+        'tweets_per_sec': {'translate': single, 'translate_many': many},
+        'words_per_sec': rates,
+    }
+
+
+def benchmark_save(results, directory):
+    """Save benchmark results as JSON, returning the file's path."""
+    directory = system.dir_check(directory, SCRIPT_DIR)
+    name = 'benchmark.' + results['time'] + '.json'
+    path = os.path.join(directory, name.replace(' ', '_'))
+    with open(path, 'w') as handle:
+        json.dump(results, handle, indent=2, sort_keys=True)
+    benchmark_log.info('Benchmark results saved: ' + path)
+    return path
+
+
+def benchmark_stats(timings):
+    """Return latency percentiles, maximum and mean for some timings."""
+    timings = sorted(timings)
+    stats = {'calls': len(timings)}
+    for percentile in PERCENTILES:
+        rank = max(int(round(percentile / 100 * len(timings))) - 1, 0)
+        stats['p' + str(percentile)] = timings[rank]
+    stats['max'] = timings[-1]
+    stats['mean'] = sum(timings) / len(timings)
+    return stats
+
+
+def corpus_copy(arguments):
+    """Return arguments with a fresh copy of the token list they start with."""
+    return (list(arguments[0]),) + tuple(arguments[1:])
+
+
+def corpus_payload(rng, idx, text):
+    """Return a stream event payload carrying some text."""
+    user = {'id': 25073877, 'screen_name': 'realDonaldTrump'}
+    payload = {'id': idx, 'text': text[:140], 'user': user}
+    if len(text) > 140:
+        payload['extended_tweet'] = {'full_text': text}
+    if rng.random() < 0.1:
+        payload['retweeted_status'] = {'id': idx + 1}
+    return json.dumps(payload)
+
+
+def corpus_text(rng, words, size, links=False):
+    """Return text built from random words up to a number of characters."""
+    text = []
+    length = 0
+    while length < size:
+        word = corpus_word(rng, words)
+        if links and rng.random() < 0.15:
+            code = ''.join(rng.choice(string.ascii_letters) for _ in range(10))
+            word = 'https://t.co/' + code
+        elif rng.random() < 0.1:
+            word = word + rng.choice(CORPUS_PUNCTUATION)
+        if length + len(word) + 1 > size and text:
+            break
+        text.append(word)
+        length = length + len(word) + 1
+    return ' '.join(text)
+
+
+def corpus_word(rng, words):
+    """Return a random vocab word, made-up word, mention, or hashtag."""
+    roll = rng.random()
+    if roll < 0.6:
+        word = rng.choice(words)
+    else:
+        syllables = rng.randint(1, 4)
+        consonants = 'bcdfghjklmnprstvwz'
+        word = ''.join(rng.choice(consonants) + rng.choice('aeiouy')
+                       for _ in range(syllables))
+    if roll > 0.97:
+        return '@' + word
+    if roll > 0.94:
+        return '#' + word.upper()
+    if rng.random() < 0.15:
+        return word.capitalize() if rng.random() < 0.8 else word.upper()
+    return word
@@ -0,0 +1,101 @@
+"""
+"""
+import argparse
+import collections
+import itertools
+import json
+import logging
+import multiprocessing
+import time
+from martiandtrump import translator, twitter, utils, vocabulary
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+bulk_log = logging.getLogger(SCRIPT_NAME + '.bulk')
+
+# Translation state belonging to each worker process, set up once.
+WORKER = {}
+
+
+def bulk_chunk(lines):
+    """Return output lines for a chunk of raw tweet records, in order."""
+    events = [bulk_parse(x) for x in lines]
+    bodies = [x['body'] if x else None for x in events]
+    translations = translator.translate_many([x for x in bodies if x],
+                                             engine=WORKER['engine'])
+
+    # Pair each record with its translation, or nothing if it had no body.
+    output = []
+    for event, body in zip(events, bodies):
+        record = dict(event) if event else {}
+        record['translation'] = next(translations) if body else None
+        output.append(json.dumps(record, ensure_ascii=False) + '\n')
+    return output
+
+
+def bulk_options(arguments):
+    """Return parsed command-line options for bulk translation."""
+    parser = argparse.ArgumentParser(prog=SCRIPT_NAME)
+    parser.add_argument('--batch', required=True,
+                        help='JSON lines file of tweet records to translate')
+    parser.add_argument('--out', required=True,
+                        help='JSON lines file to write translations to')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='worker processes, defaults to the CPU count')
+    parser.add_argument('--chunk', type=int, default=500,
+                        help='records sent to a worker at a time')
+    return parser.parse_args(arguments)
+
+
+def bulk_parse(line):
+    """Return a parsed tweet record, or False if it isn't a valid one."""
+    try:
+        return twitter.parse(line)
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        bulk_log.warn('Bulk record unreadable: ' + str(e))
+        return False
+
+
+def bulk_requested(arguments):
+    """Return True if command-line arguments ask for bulk translation."""
+    return any(x == '--batch' or x.startswith('--batch=') for x in arguments)
+
+
+def bulk_start(config_path):
+    """Prepare a worker process with its own vocab and translation engine."""
+    vocab = vocabulary.vocab_load(config_path)
+    WORKER['engine'] = translator.TranslationEngine(vocab)
+
+
+def bulk_translate(config_path, source, destination, workers=None, chunk=500):
+    """Translate a file of tweet records across processes, keeping order."""
+    workers = workers if workers else multiprocessing.cpu_count()
+    message = 'Bulk translating {} with {} workers'
+    bulk_log.info(message.format(source, workers))
+    vocabulary.vocab_load(config_path)  # Compile once, before workers race.
+    began = time.monotonic()
+    records = 0
+
+    # Keep a bounded number of chunks in flight, writing them in order.
+    with open(source) as lines, open(destination, 'w') as output, \
+            multiprocessing.Pool(workers, bulk_start, (config_path,)) as pool:
+        lines = (x for x in lines if x.strip())
+        pending = collections.deque()
+        while True:
+            batch = list(itertools.islice(lines, chunk))
+            if batch:
+                pending.append(pool.apply_async(bulk_chunk, (batch,)))
+            if pending and (not batch or len(pending) >= workers * 2):
+                written = pending.popleft().get()
+                output.writelines(written)
+                records = records + len(written)
+            if not batch and not pending:
+                break
+
+    # Report and return the throughput achieved.
+    took = time.monotonic() - began
+    rate = records / took if took else 0
+    message = 'Bulk translated {} records in {:.1f}s ({:.0f} records/sec)'
+    message = message.format(records, took, rate)
+    bulk_log.info(message)
+    return records, took, rate
@@ -23,14 +23,26 @@ def config_default(config, section, key, fallback=None):
     return fallback if value == '' else value
 
 
-def config_load(filepath):
+def config_exclude(lines, exclude=[]):
+    """Yield the lines of a config .ini file outside of excluded sections."""
+    excluded = False
+    for line in lines:
+        header = line.strip()
+        if header.startswith('[') and header.endswith(']'):
+            excluded = header[1:-1] in exclude
+        if not excluded:
+            yield line
+
+
+def config_load(filepath, exclude=[]):
     """Load the values in a config .ini file, or exit if an error happens."""
     config = configparser.ConfigParser()
 
-    # Try to read the config file.
+    # Try to read the config file, skipping any sections not needed.
     try:
         config_log.info('Reading config: ' + filepath)
-        config.read_file(open(filepath))
+        with open(filepath) as handle:
+            config.read_file(config_exclude(handle, exclude), filepath)
         return config
 
     # Exit gracefully on error, logging the failure.
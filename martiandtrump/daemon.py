@@ -0,0 +1,84 @@
+"""
+"""
+import logging
+import os
+import random
+import signal
+import socket
+import time
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+daemon_log = logging.getLogger(SCRIPT_NAME + '.daemon')
+
+
+def daemon_backoff(failures, backoff=1, ceiling=300):
+    """Return seconds to wait before reconnecting, jittered to spread out."""
+    delay = min(float(ceiling), float(backoff) * 2 ** failures)
+    return delay / 2 + random.uniform(0, delay / 2)
+
+
+def daemon_notify(state):
+    """Tell systemd about the daemon's state, if it's running under it."""
+    address = os.environ.get('NOTIFY_SOCKET')
+    if not address:
+        return False
+    if address.startswith('@'):
+        address = '\0' + address[1:]
+    try:
+        with socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM) as notify:
+            notify.connect(address)
+            notify.sendall(state.encode('utf-8'))
+        return True
+    except OSError as e:
+        daemon_log.warn('Systemd notify failed: ' + str(e))
+        return False
+
+
+def daemon_signals():
+    """Stop on a terminate signal the same way as on an interrupt."""
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+
+
+class StreamSupervisor(object):
+    """
+    Keeps a stream connected in-process, backing off between reconnections.
+    """
+
+    def __init__(self, backoff=1, ceiling=300, healthy=300):
+        """Record how to back off, and how long a healthy connection lasts."""
+        self.backoff = float(backoff)
+        self.ceiling = float(ceiling)
+        self.healthy = float(healthy)
+        self.restarts = 0
+
+    def run(self, connect):
+        """Call connect whenever the stream drops, until told to stop."""
+        daemon_signals()
+        daemon_notify('READY=1')
+        daemon_log.info('Daemon supervising stream')
+        failures = 0
+        try:
+            while True:
+                began = time.monotonic()
+                daemon_notify('STATUS=Streaming')
+                result = connect()
+
+                # A connection that stayed up a while starts backing off anew.
+                if time.monotonic() - began > self.healthy:
+                    failures = 0
+                delay = daemon_backoff(failures, self.backoff, self.ceiling)
+                failures += 1
+                message = 'Stream {}, reconnecting in {:.1f}s'.format(
+                    'ended' if result else 'failed', delay)
+                daemon_log.warn(message)
+                daemon_notify('STATUS=' + message)
+                time.sleep(delay)
+                self.restarts += 1
+
+        # Interrupts and terminate signals both stop the daemon cleanly.
+        except KeyboardInterrupt:
+            daemon_log.info('Daemon stopping after ' + str(self.restarts) +
+                            ' reconnections')
+            daemon_notify('STOPPING=1')
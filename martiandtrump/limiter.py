@@ -0,0 +1,94 @@
+"""
+"""
+import logging
+import threading
+import time
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+limiter_log = logging.getLogger(SCRIPT_NAME + '.limiter')
+
+# Longest back off after repeated rate limit responses, in seconds.
+BACKOFF_CEILING = 3600
+
+
+class RateLimiter(object):
+    """
+    A token bucket for outbound API calls, tightened by rate limit responses.
+    """
+
+    def __init__(self, posts=300, window=10800, backoff=60):
+        """Start with a full bucket refilling posts tokens per window."""
+        self.backoff = float(backoff)
+        self.blocked = 0.0
+        self.capacity = float(posts)
+        self.failures = 0
+        self.lock = threading.Lock()
+        self.rate = float(posts) / float(window)
+        self.tokens = float(posts)
+        self.updated = time.monotonic()
+
+    def acquire(self):
+        """Take a token, or return the seconds until one can be taken."""
+        with self.lock:
+            wait = self.wait(time.monotonic())
+            if wait <= 0:
+                self.tokens -= 1
+            return wait
+
+    def delay(self):
+        """Return the seconds until a token can be taken, without taking it."""
+        with self.lock:
+            return self.wait(time.monotonic())
+
+    def refill(self, now):
+        """Add the tokens earned since the bucket was last looked at."""
+        earned = (now - self.updated) * self.rate
+        self.tokens = min(self.capacity, self.tokens + earned)
+        self.updated = now
+
+    def succeed(self):
+        """Forget earlier rate limit responses after a call gets through."""
+        with self.lock:
+            self.failures = 0
+
+    def throttle(self, headers={}):
+        """Back off after a rate limit response, returning the delay."""
+        with self.lock:
+            self.failures += 1
+            delay = self.backoff * 2 ** (self.failures - 1)
+            delay = min(delay, BACKOFF_CEILING)
+
+            # Respect the API's own idea of when to come back, if it has one.
+            retry_after = headers.get('retry-after')
+            reset = headers.get('x-rate-limit-reset')
+            if retry_after and retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+            elif reset and reset.isdigit():
+                delay = max(delay, float(reset) - time.time())
+            self.blocked = max(self.blocked, time.monotonic() + delay)
+        limiter_log.warn('Rate limited, backing off for {:.0f}s'.format(delay))
+        return delay
+
+    def update(self, headers):
+        """Tighten the bucket to any rate limit headers the API sent."""
+        remaining = headers.get('x-rate-limit-remaining')
+        reset = headers.get('x-rate-limit-reset')
+        if remaining is None or not remaining.isdigit():
+            return
+        with self.lock:
+            self.refill(time.monotonic())
+            self.tokens = min(self.tokens, float(remaining))
+            if int(remaining) == 0 and reset and reset.isdigit():
+                until = time.monotonic() + float(reset) - time.time()
+                self.blocked = max(self.blocked, until)
+
+    def wait(self, now):
+        """Return the seconds until a token is free, with the lock held."""
+        self.refill(now)
+        if now < self.blocked:
+            return self.blocked - now
+        if self.tokens >= 1:
+            return 0
+        return (1 - self.tokens) / self.rate
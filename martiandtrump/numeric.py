@@ -0,0 +1,157 @@
+"""
+"""
+import logging
+import re
+from martiandtrump import translator, utils
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+numeric_log = logging.getLogger(SCRIPT_NAME + '.numeric')
+
+# Longest token encoded into the matrix, anything longer is counted singly.
+SYLLABLES_WIDTH = 48
+SYLLABLES_VOWELS = b'aeiouy'
+SYLLABLES_WHITESPACE = b' \t\n\r\x0b\x0c\x1c\x1d\x1e\x1f'
+
+
+def syllables_array(tokens):
+    """Return a list of syllable counts for many tokens at once."""
+    tokens = list(tokens)
+    if numpy is None:
+        numeric_log.warn('NumPy not installed, counting syllables singly')
+        return [translator.syllables(x) for x in tokens]
+    result = numpy.zeros(len(tokens), dtype=numpy.int64)
+
+    # Only short ASCII tokens are encoded, leaving oddities to the original.
+    simple = [x.isascii() and len(x) <= SYLLABLES_WIDTH and '\n' not in x
+              for x in tokens]
+    for idx, token in enumerate(tokens):
+        if not simple[idx]:
+            result[idx] = translator.syllables(token)
+    simple = numpy.flatnonzero(simple)
+    if len(simple):
+        encoded = [tokens[idx] for idx in simple]
+        result[simple] = syllables_matrix(encoded)
+    return result.tolist()
+
+
+def syllables_compile(pattern):
+    """Return per-character byte tables and an end anchor for a pattern."""
+    tables = []
+    anchored = False
+    idx = 0
+    while idx < len(pattern):
+        character = pattern[idx]
+        table = numpy.zeros(256, dtype=bool)
+
+        # Parse the next atom of the pattern into a table of allowed bytes.
+        if character == '^' and idx == 0 or character in '()':
+            idx = idx + 1
+            continue
+        elif character == '$' and idx == len(pattern) - 1:
+            anchored = True
+            idx = idx + 1
+            continue
+        elif character == '[':
+            finish = pattern.index(']', idx)
+            members = pattern[idx + 1:finish]
+            negated = members.startswith('^')
+            members = members[1:] if negated else members
+            if '-' in members or '\\' in members:
+                return None  # Ranges and escapes aren't worth supporting.
+            table[list(members.encode('ascii'))] = True
+            table = ~table if negated else table
+            idx = finish + 1
+        elif character == '.':
+            table[:] = True
+            table[ord('\n')] = False
+            idx = idx + 1
+        elif character == '{':
+            finish = pattern.index('}', idx)
+            repeat = int(pattern[idx + 1:finish])
+            tables.extend([tables[-1]] * (repeat - 1))
+            idx = finish + 1
+            continue
+        elif character in '\\|*+?' or not character.isascii():
+            return None  # Not simple enough to match by tables.
+        else:
+            table[ord(character)] = True
+            idx = idx + 1
+        tables.append(table)
+    return tables, anchored
+
+
+def syllables_edgecases():
+    """Return the syllable edge-cases compiled into byte tables or regexes."""
+    compiled = []
+    for case, modifier in translator.syllables_edgecases():
+        compiled.append((re.compile(case), syllables_compile(case), modifier))
+    return compiled
+
+
+def syllables_matrix(tokens):
+    """Return syllable counts for ASCII tokens using vectorized matrices."""
+    width = max(len(x) for x in tokens)
+    if not width:
+        return numpy.zeros(len(tokens), dtype=numpy.int64)
+    encoded = b''.join(x.encode('ascii').ljust(width, b'\0') for x in tokens)
+    matrix = numpy.frombuffer(encoded, dtype=numpy.uint8)
+    matrix = matrix.reshape(len(tokens), width)
+    lengths = numpy.array([len(x) for x in tokens])
+    columns = numpy.arange(width)
+    inside = columns < lengths[:, None]
+
+    # Uncountable tokens have simple results, all whitespace or very short.
+    whitespace = numpy.isin(matrix, list(SYLLABLES_WHITESPACE)) | ~inside
+    whitespace = whitespace.all(axis=1)
+    short = lengths < 2
+
+    # Lowercase, then squeeze out apostrophes by shuffling characters left.
+    lowered = numpy.where((matrix >= 65) & (matrix <= 90), matrix + 32, matrix)
+    keep = inside & (lowered != ord("'"))
+    rows, cols = numpy.nonzero(keep)
+    shifted = numpy.cumsum(keep, axis=1)[rows, cols] - 1
+    test = numpy.zeros_like(lowered)
+    test[rows, shifted] = lowered[rows, cols]
+    lengths = keep.sum(axis=1)
+
+    # Strip trailing e's by finding the last character that isn't one.
+    kept = (test != ord('e')) & (columns < lengths[:, None])
+    last = width - numpy.argmax(kept[:, ::-1], axis=1)
+    lengths = numpy.where(kept.any(axis=1), last, 0)
+    test[columns >= lengths[:, None]] = 0
+
+    # The number of syllables is usually the number of vowel groups.
+    vowels = numpy.isin(test, list(SYLLABLES_VOWELS))
+    starts = vowels.copy()
+    starts[:, 1:] &= ~vowels[:, :-1]
+    result = starts.sum(axis=1)
+
+    # Edge-cases anchor to the start, so compare them column by column.
+    for case, compiled, modifier in SYLLABLES_EDGECASES:
+        if compiled is None:
+            texts = zip(test, lengths)
+            texts = [bytes(x[:n]).decode('ascii') for x, n in texts]
+            matched = numpy.array([bool(case.match(x)) for x in texts])
+        else:
+            tables, anchored = compiled
+            matched = lengths >= len(tables)
+            if anchored:
+                matched &= lengths == len(tables)
+            for idx, table in enumerate(tables[:width]):
+                matched &= table[test[:, idx]]
+        result = result + matched * modifier
+
+    # Tidy up the results as the original does.
+    result = numpy.maximum(result, 1)
+    result = numpy.where(short, 1, result)
+    return numpy.where(whitespace, 0, result)
+
+
+# Edge-cases are compiled once, if there's NumPy to compile them with.
+SYLLABLES_EDGECASES = syllables_edgecases() if numpy is not None else []
@@ -0,0 +1,175 @@
+"""
+"""
+import json
+import logging
+import os
+import threading
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+outbox_log = logging.getLogger(SCRIPT_NAME + '.outbox')
+
+# Records in the log before it's worth rewriting with only pending entries.
+COMPACT_AFTER = 1000
+
+
+def outbox_path(name='outbox'):
+    """Return the path of an outbox log."""
+    return os.path.join(SCRIPT_DIR, 'cache', name + '.log')
+
+
+def outbox_read(path):
+    """Return the entries added to an outbox log and never acknowledged."""
+    entries = {}
+    records = 0
+    try:
+        with open(path, encoding='utf-8') as lines:
+            for line in lines:
+                # A torn last line is a write that was never committed.
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    outbox_log.warn('Outbox record unreadable, skipped')
+                    continue
+                records += 1
+                if record['op'] == 'add':
+                    entries[record['id']] = record
+                else:
+                    entries.pop(record['id'], None)
+    except FileNotFoundError:
+        pass
+    return entries, records
+
+
+class Outbox(object):
+    """
+    A durable queue of posts, committed to disk in groups before sending.
+    """
+
+    def __init__(self, path=None):
+        """Open the outbox log, keeping only entries still waiting to send."""
+        self.path = os.path.join(SCRIPT_DIR, path) if path else outbox_path()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self.condition = threading.Condition()
+        self.entries, _ = outbox_read(self.path)
+        self.ids = max(self.entries, default=0)
+        self.records = 0
+        self.required = 0
+        self.stopping = False
+        self.synced = 0
+        self.syncs = 0
+        self.written = 0
+        self.handle = None
+        self.compact()
+        if self.entries:
+            outbox_log.info('Outbox has ' + str(len(self.entries)) +
+                            ' unsent posts')
+
+        # One thread commits whatever has been written since the last sync.
+        self.thread = threading.Thread(target=self.run, name='outbox',
+                                       daemon=True)
+        self.thread.start()
+
+    def ack(self, entry_id):
+        """Mark an entry sent, without waiting for that to reach the disk."""
+        with self.condition:
+            if self.entries.pop(entry_id, None) is None:
+                return
+            self.write({'op': 'ack', 'id': entry_id})
+            self.handle.flush()  # Survives the process dying, if not power.
+            if self.records > COMPACT_AFTER and \
+                    len(self.entries) * 4 < self.records:
+                self.compact()
+                self.condition.notify_all()
+
+    def add(self, body, key=None, reply_to=None, source=None):
+        """Add a post to the outbox, returning it once it's on disk."""
+        with self.condition:
+            self.ids += 1
+            entry = {'op': 'add', 'id': self.ids, 'body': body, 'key': key,
+                     'reply_to': reply_to, 'source': source}
+            self.entries[entry['id']] = entry
+            self.required = self.write(entry)
+            self.condition.notify_all()
+
+            # Wait for the committing thread to sync this write, and others.
+            written = self.required
+            while self.synced < written and not self.stopping:
+                self.condition.wait()
+        return entry
+
+    def close(self):
+        """Commit anything outstanding and close the outbox log."""
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+        self.thread.join()
+        with self.condition:
+            self.sync()
+            self.handle.close()
+
+    def compact(self):
+        """Rewrite the log with only pending entries, with the lock held."""
+        if self.handle:
+            self.handle.close()
+        temporary = self.path + '.' + str(os.getpid())
+        with open(temporary, 'w', encoding='utf-8') as handle:
+            for entry_id in sorted(self.entries):
+                entry = self.entries[entry_id]
+                handle.write(json.dumps(entry, ensure_ascii=False) + '\n')
+            handle.flush()
+            os.fsync(handle.fileno())
+        os.replace(temporary, self.path)
+        self.handle = open(self.path, 'a', encoding='utf-8')
+        self.records = len(self.entries)
+        self.synced = self.written
+
+    def pending(self):
+        """Return entries still waiting to be sent, oldest first."""
+        with self.condition:
+            return [self.entries[x] for x in sorted(self.entries)]
+
+    def run(self):
+        """Sync added entries as they arrive, several at a time if waiting."""
+        while True:
+            # Acks aren't waited on, they're synced along with the next add.
+            with self.condition:
+                while self.synced >= self.required and not self.stopping:
+                    self.condition.wait()
+                if self.stopping:
+                    return
+                self.handle.flush()
+                handle = self.handle
+                written = self.written
+
+            # Sync outside the lock, so writes arriving meanwhile batch up.
+            try:
+                os.fsync(handle.fileno())
+            except ValueError:
+                pass  # Compacted meanwhile, which syncs its own new log.
+            except OSError as error:
+                outbox_log.error('Outbox sync failed: ' + str(error))
+            with self.condition:
+                self.syncs += 1
+                self.synced = max(self.synced, written)
+                self.condition.notify_all()
+
+    def stats(self):
+        """Return counts of pending entries, records and syncs."""
+        with self.condition:
+            return {'pending': len(self.entries), 'records': self.records,
+                    'syncs': self.syncs, 'writes': self.written}
+
+    def sync(self):
+        """Flush and sync the log straight away, with the lock held."""
+        self.handle.flush()
+        os.fsync(self.handle.fileno())
+        self.synced = self.written
+
+    def write(self, record):
+        """Append a record to the log, returning its write number."""
+        self.handle.write(json.dumps(record, ensure_ascii=False) + '\n')
+        self.records += 1
+        self.written += 1
+        return self.written
@@ -0,0 +1,184 @@
+"""
+"""
+import asyncio
+import collections
+import concurrent.futures
+import functools
+import logging
+import threading
+import time
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+pipeline_log = logging.getLogger(SCRIPT_NAME + '.pipeline')
+
+# Items dropped between warnings when the pipeline is full.
+DROPS_LOGGED = 100
+# Recent end-to-end latencies kept for working out percentiles.
+LATENCY_SAMPLES = 100000
+
+
+class Pipeline(object):
+    """
+    Passes items through stages of workers on an asyncio loop of its own.
+    """
+
+    def __init__(self, stages, size=100, interval=60):
+        """Start a loop thread running workers for each (name, func, n)."""
+        pipeline_log.debug('Pipeline starting')
+        self.dropped = 0
+        self.finished = 0
+        self.interval = interval
+        self.latency = {'total': 0.0, 'slowest': 0.0}
+        self.latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self.lock = threading.Lock()
+        self.size = size
+        self.stages = []
+        for name, function, workers in stages:
+            self.stages.append({
+                'busy': 0.0,
+                'done': 0,
+                'errors': 0,
+                'function': function,
+                'name': name,
+                'queue': None,
+                'slowest': 0.0,
+                'workers': int(workers),
+            })
+
+        # Blocking stage functions run on threads, the loop just shuffles.
+        threads = sum(x['workers'] for x in self.stages)
+        self.executor = concurrent.futures.ThreadPoolExecutor(threads)
+        self.loop = asyncio.new_event_loop()
+        self.ready = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='pipeline',
+                                       daemon=True)
+        self.thread.start()
+        self.ready.wait()
+
+    async def drain(self):
+        """Wait for every queued item to make its way through every stage."""
+        for stage in self.stages:
+            await stage['queue'].join()
+
+    def enqueue(self, item, entered):
+        """Queue an item for the first stage, dropping it if that's full."""
+        try:
+            self.stages[0]['queue'].put_nowait((item, entered))
+        except asyncio.QueueFull:
+            # Only warn now and then, a burst could otherwise flood the logs.
+            self.dropped += 1
+            if self.dropped % DROPS_LOGGED == 1:
+                pipeline_log.warn('Pipeline full, dropped ' +
+                                  str(self.dropped))
+
+    def finish(self, entered, handle=None):
+        """Count an item finished, and how long it took from submission."""
+        if getattr(handle, 'cancelled', False):
+            return  # Never finished, so there's no latency to speak of.
+        latency = time.monotonic() - entered
+        with self.lock:
+            self.finished += 1
+            self.latency['total'] += latency
+            self.latency['slowest'] = max(self.latency['slowest'], latency)
+            self.latencies.append(latency)
+
+    async def report(self):
+        """Periodically log how deep each queue is and how long stages take."""
+        while True:
+            await asyncio.sleep(self.interval)
+            pipeline_log.info('Pipeline stats: ' + str(self.stats()))
+
+    def run(self):
+        """Run the loop with its queues and workers until stopped."""
+        asyncio.set_event_loop(self.loop)
+        for idx, stage in enumerate(self.stages):
+            stage['queue'] = asyncio.Queue(self.size)
+            for _ in range(stage['workers']):
+                self.loop.create_task(self.work(idx))
+        if self.interval:
+            self.loop.create_task(self.report())
+        self.loop.call_soon(self.ready.set)
+        self.loop.run_forever()
+
+        # Cancel the now idle workers before closing the loop.
+        tasks = asyncio.all_tasks(self.loop)
+        for task in tasks:
+            task.cancel()
+        self.loop.run_until_complete(
+            asyncio.gather(*tasks, return_exceptions=True))
+        self.loop.close()
+
+    def stats(self):
+        """Return queue depths, stage timings and end-to-end latency."""
+        stats = {
+            'dropped': self.dropped,
+            'finished': self.finished,
+            'latency_mean': self.latency['total'] / max(self.finished, 1),
+            'latency_max': self.latency['slowest'],
+        }
+        for stage in self.stages:
+            stats[stage['name']] = {
+                'depth': stage['queue'].qsize() if stage['queue'] else 0,
+                'done': stage['done'],
+                'errors': stage['errors'],
+                'mean': stage['busy'] / max(stage['done'], 1),
+                'max': stage['slowest'],
+            }
+        return stats
+
+    def stop(self, timeout=30):
+        """Let queued items finish, then stop the loop and its workers."""
+        if not self.thread.is_alive():
+            return
+        pipeline_log.debug('Pipeline stopping')
+        draining = asyncio.run_coroutine_threadsafe(self.drain(), self.loop)
+        try:
+            draining.result(timeout)
+        except concurrent.futures.TimeoutError:
+            pipeline_log.warn('Pipeline stopped before draining: ' +
+                              str(self.stats()))
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join(timeout)
+        self.executor.shutdown(wait=False)
+        pipeline_log.info('Pipeline stopped: ' + str(self.stats()))
+
+    def submit(self, item):
+        """Hand an item to the pipeline from any thread without blocking."""
+        self.loop.call_soon_threadsafe(self.enqueue, item, time.monotonic())
+
+    async def work(self, idx):
+        """Take items from a stage's queue, process them, and pass them on."""
+        stage = self.stages[idx]
+        following = None
+        if idx + 1 < len(self.stages):
+            following = self.stages[idx + 1]
+        while True:
+            item, entered = await stage['queue'].get()
+            began = time.monotonic()
+
+            # Run the stage's function on a thread so the loop stays free.
+            try:
+                result = await self.loop.run_in_executor(
+                    self.executor, stage['function'], item)
+            except Exception as e:
+                pipeline_log.error('Pipeline ' + stage['name'] + ' failed: ' +
+                                   str(e))
+                stage['errors'] += 1
+                result = None
+
+            # Record timings, and pass results on unless they're finished.
+            took = time.monotonic() - began
+            stage['busy'] += took
+            stage['done'] += 1
+            stage['slowest'] = max(stage['slowest'], took)
+            if result is not None and following:
+                await following['queue'].put((result, entered))
+            # Items handed off to finish later are timed when they do.
+            elif not following and hasattr(result, 'add_done_callback'):
+                result.add_done_callback(functools.partial(self.finish,
+                                                           entered))
+            elif not following:
+                self.finish(entered)
+            stage['queue'].task_done()
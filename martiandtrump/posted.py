@@ -0,0 +1,187 @@
+"""
+"""
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+posted_log = logging.getLogger(SCRIPT_NAME + '.posted')
+
+# File layout: a header, then a hash table of source and posted ID pairs.
+POSTED_HEADER = struct.Struct('<4sHHQQ')
+POSTED_MAGIC = b'MDTP'
+POSTED_SLOT = struct.Struct('<qq')
+POSTED_VERSION = 1
+
+# Share of slots in use, deleted ones included, before the map is rebuilt.
+POSTED_LOAD = 0.5
+
+# Slot markers, tweet IDs always being positive.
+SLOT_EMPTY = 0
+SLOT_REMOVED = -1
+
+# Milliseconds from the Unix epoch to the one tweet IDs count from.
+TWITTER_EPOCH = 1288834974657
+
+
+def posted_path(name='posted'):
+    """Return the path of a posted tweet map."""
+    return os.path.join(SCRIPT_DIR, 'cache', name + '.map')
+
+
+def posted_time(tweet_id):
+    """Return the Unix time a tweet was posted, from its ID."""
+    return ((tweet_id >> 22) + TWITTER_EPOCH) / 1000.0
+
+
+class PostedMap(object):
+    """
+    Maps source tweet IDs to the IDs of their translations, in a mapped file.
+    """
+
+    def __init__(self, path=None, window=604800, slots=65536):
+        """Open the map file, creating or rebuilding it as needed."""
+        self.path = os.path.join(SCRIPT_DIR, path) if path else posted_path()
+        self.lock = threading.Lock()
+        self.minimum = 1 << max(4, int(slots) - 1).bit_length()
+        self.window = float(window)
+        self.data = None
+        self.handle = None
+        try:
+            self.open()
+        except FileNotFoundError:
+            self.rebuild([])
+        except (OSError, ValueError) as e:
+            posted_log.warn('Posted map unusable, starting afresh: ' + str(e))
+            self.rebuild([])
+
+    def close(self):
+        """Flush the map to disk and unmap it."""
+        with self.lock:
+            self.data.flush()
+            self.data.close()
+            self.handle.close()
+
+    def entries(self):
+        """Yield the source and posted ID pairs still in their window."""
+        oldest = time.time() - self.window
+        for slot in range(self.slots):
+            source_id, posted_id = self.slot(slot)
+            if source_id > 0 and posted_time(source_id) >= oldest:
+                yield source_id, posted_id
+
+    def find(self, source_id):
+        """Return the slot holding a source ID, or None, lock held."""
+        slot = self.start(source_id)
+        for _ in range(self.slots):
+            found, _ = self.slot(slot)
+            if found == source_id:
+                return slot
+            if found == SLOT_EMPTY:
+                return None
+            slot = (slot + 1) % self.slots
+        return None
+
+    def get(self, source_id):
+        """Return the ID a source tweet was translated as, or None."""
+        source_id = int(source_id)
+        with self.lock:
+            slot = self.find(source_id)
+            if slot is None:
+                return None
+            if posted_time(source_id) < time.time() - self.window:
+                return None
+            return self.slot(slot)[1]
+
+    def open(self):
+        """Map an existing file into memory, checking its header."""
+        self.handle = open(self.path, 'r+b')
+        self.data = mmap.mmap(self.handle.fileno(), 0)
+        magic, version, _, self.slots, self.used = \
+            POSTED_HEADER.unpack_from(self.data)
+        if (magic, version) != (POSTED_MAGIC, POSTED_VERSION):
+            raise ValueError('Not a posted map: ' + self.path)
+        if len(self.data) != POSTED_HEADER.size + \
+                self.slots * POSTED_SLOT.size:
+            raise ValueError('Posted map truncated: ' + self.path)
+
+    def pop(self, source_id):
+        """Remove a source tweet, returning its translation's ID or None."""
+        source_id = int(source_id)
+        with self.lock:
+            slot = self.find(source_id)
+            if slot is None:
+                return None
+            _, posted_id = self.slot(slot)
+            self.store(slot, SLOT_REMOVED, 0)
+        if posted_time(source_id) < time.time() - self.window:
+            return None
+        return posted_id
+
+    def put(self, source_id, posted_id):
+        """Record the ID a source tweet was translated as."""
+        source_id = int(source_id)
+        with self.lock:
+            slot = self.find(source_id)
+            if slot is None:
+                # Rebuild without aged out and removed entries when full.
+                if self.used + 1 > self.slots * POSTED_LOAD:
+                    self.rebuild(list(self.entries()))
+                slot = self.start(source_id)
+                while self.slot(slot)[0] > 0:
+                    slot = (slot + 1) % self.slots
+                if self.slot(slot)[0] == SLOT_EMPTY:
+                    self.used += 1
+                    POSTED_HEADER.pack_into(self.data, 0, POSTED_MAGIC,
+                                            POSTED_VERSION, 0, self.slots,
+                                            self.used)
+            self.store(slot, source_id, int(posted_id))
+
+    def rebuild(self, entries):
+        """Write a new map holding only some entries, then map it."""
+        slots = self.minimum
+        while len(entries) + 1 > slots * POSTED_LOAD / 2:
+            slots *= 2
+        table = bytearray(slots * POSTED_SLOT.size)
+        for source_id, posted_id in entries:
+            slot = self.start(source_id, slots)
+            while POSTED_SLOT.unpack_from(table, slot * POSTED_SLOT.size)[0]:
+                slot = (slot + 1) % slots
+            POSTED_SLOT.pack_into(table, slot * POSTED_SLOT.size, source_id,
+                                  posted_id)
+        header = POSTED_HEADER.pack(POSTED_MAGIC, POSTED_VERSION, 0, slots,
+                                    len(entries))
+
+        # Write to a temporary file and rename it so readers never see half.
+        if self.data is not None:
+            self.data.close()
+        if self.handle is not None:
+            self.handle.close()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        temporary = self.path + '.' + str(os.getpid())
+        with open(temporary, 'wb') as handle:
+            handle.write(header + table)
+        os.replace(temporary, self.path)
+        self.open()
+        posted_log.debug('Posted map rebuilt with %s of %s slots used',
+                         len(entries), slots)
+
+    def slot(self, slot):
+        """Return the source and posted IDs stored in a slot."""
+        offset = POSTED_HEADER.size + slot * POSTED_SLOT.size
+        return POSTED_SLOT.unpack_from(self.data, offset)
+
+    def start(self, source_id, slots=None):
+        """Return the slot a source ID's search starts from."""
+        slots = self.slots if slots is None else slots
+        return (source_id * 0x9E3779B97F4A7C15 >> 17) % slots
+
+    def store(self, slot, source_id, posted_id):
+        """Write the source and posted IDs into a slot."""
+        offset = POSTED_HEADER.size + slot * POSTED_SLOT.size
+        POSTED_SLOT.pack_into(self.data, offset, source_id, posted_id)
@@ -0,0 +1,177 @@
+"""
+"""
+import json
+import logging
+import os
+import threading
+import time
+import tweepy
+from martiandtrump import benchmark, resolver, utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+replay_log = logging.getLogger(SCRIPT_NAME + '.replay')
+
+# Seconds between samples of how far behind the pipeline has fallen.
+BACKLOG_INTERVAL = 0.1
+
+
+def replay_events(path):
+    """Yield (timestamp, payload) pairs from a file of recorded events."""
+    with open(path) as lines:
+        for line in lines:
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                yield record['time'], record['data']
+            except (ValueError, KeyError, TypeError) as e:
+                replay_log.warn('Recorded event unreadable: ' + str(e))
+
+
+def replay_report(report):
+    """Return a printable summary of a replay."""
+    latency = report['latency']
+    lines = [
+        '{} events replayed in {:.1f}s, {:.0f} events/sec sustained'.format(
+            report['events'], report['took'], report['rate']),
+        '{} posted, {} dropped, {} duplicates, peak backlog {} events'.format(
+            report['posted'], report['dropped'], report['duplicates'],
+            report['backlog']),
+    ]
+    if latency:
+        message = 'latency (ms): p50 {:.1f}, p90 {:.1f}, p99 {:.1f}, ' + \
+            'max {:.1f}'
+        lines.append(message.format(latency['p50'], latency['p90'],
+                                    latency['p99'], latency['max']))
+    return '\n'.join(lines)
+
+
+def replay_run(path, listener, speed=1.0):
+    """Feed recorded events to a stream listener, at speed times real time."""
+    message = 'Replaying {} at {}'
+    replay_log.info(message.format(path, str(speed) + 'x' if speed else 'max'))
+    events = 0
+    peak = [0]
+    replaying = threading.Event()
+
+    # Sample the pipeline's queues while events are going in.
+    def sample():
+        while not replaying.wait(BACKLOG_INTERVAL):
+            stats = listener.pipeline.stats()
+            depth = sum(v['depth'] for v in stats.values()
+                        if isinstance(v, dict))
+            peak[0] = max(peak[0], depth)
+    sampler = threading.Thread(target=sample, name='backlog', daemon=True)
+    sampler.start()
+
+    # Keep each event's offset from the first, scaled by the speed.
+    began = time.monotonic()
+    first = None
+    for timestamp, payload in replay_events(path):
+        first = timestamp if first is None else first
+        if speed:
+            wait = began + (timestamp - first) / speed - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+        listener.on_data(payload)
+        events += 1
+
+    # Let everything fed in make its way out before measuring.
+    listener.close()
+    took = time.monotonic() - began
+    replaying.set()
+    sampler.join()
+    stats = listener.pipeline.stats()
+    latencies = [x * 1000 for x in listener.pipeline.latencies]
+    return {
+        'backlog': peak[0],
+        'dropped': stats['dropped'],
+        'duplicates': listener.seen.stats()['duplicates'],
+        'events': events,
+        'latency': benchmark.benchmark_stats(latencies) if latencies else {},
+        'posted': len(listener.account.posts),
+        'rate': events / took if took else 0,
+        'took': took,
+    }
+
+
+class EventRecorder(object):
+    """
+    Appends raw stream payloads to a file with the time they arrived.
+    """
+
+    def __init__(self, path):
+        """Open the recording for appending, one JSON record per line."""
+        path = os.path.join(SCRIPT_DIR, path)
+        replay_log.info('Recording stream events to ' + path)
+        self.lock = threading.Lock()
+        self.output = open(path, 'a', buffering=1)
+
+    def close(self):
+        """Close the recording."""
+        with self.lock:
+            self.output.close()
+
+    def record(self, payload):
+        """Append a raw payload to the recording."""
+        if isinstance(payload, bytes):
+            payload = payload.decode('utf-8')
+        line = json.dumps({'time': time.time(), 'data': payload})
+        with self.lock:
+            self.output.write(line + '\n')
+
+
+class FakeClient(tweepy.API):
+    """
+    Stands in for a Twitter client, remembering posts instead of sending them.
+    """
+
+    def __init__(self, latency=0):
+        """Prepare an unauthenticated client taking latency seconds a post."""
+        tweepy.API.__init__(self)
+        self.deleted = []
+        self.latency = latency
+        self.lock = threading.Lock()
+        self.posts = []
+
+    def destroy_status(self, id):
+        """Pretend to delete a tweet."""
+        with self.lock:
+            self.deleted.append(id)
+        return id
+
+    def retweet(self, id):
+        """Pretend to retweet a tweet."""
+        return self.update_status('RT ' + str(id))
+
+    def update_status(self, status=None, in_reply_to_status_id=None,
+                      **params):
+        """Pretend to post a tweet, taking as long as the real API might."""
+        if self.latency:
+            time.sleep(self.latency)
+        with self.lock:
+            self.posts.append(status)
+            posted_id = len(self.posts)
+        return tweepy.Status.parse(self, {'id': posted_id, 'text': status})
+
+
+class FakeResolver(resolver.URLResolver):
+    """
+    Stands in for a URL resolver, leaving links as they are without asking.
+    """
+
+    def __init__(self, latency=0):
+        """Prepare a resolver taking latency seconds to follow a link."""
+        resolver.URLResolver.__init__(self)
+        self.latency = latency
+
+    def __reduce__(self):
+        """Pickle just the latency, other processes start their own."""
+        return FakeResolver, (self.latency,)
+
+    def follow(self, url):
+        """Pretend to follow a link, taking as long as the network might."""
+        if self.latency:
+            time.sleep(self.latency)
+        return url, True
@@ -0,0 +1,124 @@
+"""
+"""
+import concurrent.futures
+import logging
+import requests
+import threading
+import time
+import urllib.parse
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+resolver_log = logging.getLogger(SCRIPT_NAME + '.resolver')
+
+
+class URLResolver(object):
+    """
+    Follows link redirects with a pooled session, a deadline, and a cache.
+    """
+
+    def __init__(self, deadline=5, ttl=3600, size=1024, workers=8,
+                 redirects=10, retry=60):
+        """Prepare a pooled session and a resolved URL cache."""
+        resolver_log.debug('URL resolver initializing')
+        self.settings = (deadline, ttl, size, workers, redirects, retry)
+        adapter = requests.adapters.HTTPAdapter(pool_connections=workers,
+                                                pool_maxsize=workers)
+        self.session = requests.Session()
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.cache = utils.LRUCache(size, ttl)
+        self.deadline = deadline
+        self.redirects = redirects
+        self.retry = retry
+
+        # Worker threads only start once several links need following.
+        self.lock = threading.Lock()
+        self.threads = workers
+        self.workers = None
+
+    def __reduce__(self):
+        """Pickle just the settings, other processes start their own."""
+        return type(self), self.settings
+
+    def close(self):
+        """Stop any worker threads and close pooled connections."""
+        with self.lock:
+            if self.workers is not None:
+                self.workers.shutdown(wait=False)
+        self.session.close()
+
+    def follow(self, url):
+        """Return how far a URL got before the deadline, and if it finished."""
+        deadline = time.monotonic() + self.deadline
+        location = url
+        finished = False
+
+        # Follow one redirect at a time so the deadline covers every hop.
+        try:
+            for _ in range(self.redirects):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    resolver_log.warn('URL deadline passed for ' + url)
+                    break
+                response = self.request(location, remaining)
+                if not response.is_redirect:
+                    finished = True
+                    break
+                redirect = response.headers['location']
+                location = urllib.parse.urljoin(location, redirect)
+
+        # Leave a URL as far as it got if the network misbehaves.
+        except requests.RequestException as error:
+            resolver_log.warn('URL resolving failed: ' + str(error))
+
+        resolver_log.debug('URL <%s> resolved as <%s>', url, location)
+        return location, finished
+
+    def remember(self, url, location, finished=True):
+        """Cache where a URL led, briefly if it never got to the end."""
+        ttl = None if finished else self.retry
+        self.cache.put(url, (location, finished), ttl)
+        return location
+
+    def request(self, url, timeout):
+        """Return a bodiless response for a URL, trying HEAD before GET."""
+        response = self.session.head(url, allow_redirects=False,
+                                     timeout=timeout)
+        if response.status_code in [403, 405, 501]:
+            resolver_log.debug('URL <%s> refused HEAD, trying GET', url)
+            response = self.session.get(url, allow_redirects=False,
+                                        timeout=timeout, stream=True)
+            response.close()  # The body isn't needed, don't download it.
+        return response
+
+    def resolve(self, url):
+        """Return the cached or freshly followed destination of a URL."""
+        resolved = self.cache.get(url)
+        if resolved is None:
+            return self.remember(url, *self.follow(url))
+        return resolved[0]
+
+    def resolve_many(self, urls):
+        """Return a dictionary of destinations, following URLs concurrently."""
+        urls = set(urls)
+        todo = [x for x in urls if x not in self.cache]
+        if len(todo) > 1:
+            resolver_log.debug('URL resolving %s concurrently', len(todo))
+            with self.lock:
+                if self.workers is None:
+                    self.workers = concurrent.futures.ThreadPoolExecutor(
+                        self.threads)
+            followed = self.workers.map(self.follow, todo)
+            for url, resolved in zip(todo, followed):
+                self.remember(url, *resolved)
+        return {x: self.resolve(x) for x in urls}
+
+    def settled(self, url):
+        """Return True if a URL has been followed to its destination."""
+        resolved = self.cache.peek(url)
+        return resolved is not None and resolved[1]
+
+
+URL_RESOLVER = URLResolver()
@@ -0,0 +1,245 @@
+"""
+"""
+import heapq
+import itertools
+import logging
+import threading
+import time
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+scheduler_log = logging.getLogger(SCRIPT_NAME + '.scheduler')
+
+
+class PostScheduler(object):
+    """
+    Holds delayed posts in a time-ordered heap, firing them from one thread.
+    """
+
+    def __init__(self, retries=100, attempts=5):
+        """Prepare an empty heap, starting the timer thread when needed."""
+        self.attempts = attempts
+        self.condition = threading.Condition()
+        self.heap = []
+        self.keys = {}
+        self.order = itertools.count()
+        self.retries = retries
+        self.retrying = 0
+        self.stopping = False
+        self.thread = None
+
+    def __len__(self):
+        """Return the number of posts still waiting to fire."""
+        with self.condition:
+            return sum(1 for _, _, x in self.heap if not x.cancelled)
+
+    def cancel(self, key):
+        """Cancel every waiting post scheduled under a key, returning them."""
+        with self.condition:
+            cancelled = [x for x in self.keys.pop(key, []) if x.cancel()]
+        if cancelled:
+            scheduler_log.info('Cancelled ' + str(len(cancelled)) +
+                               ' scheduled posts for ' + str(key))
+        return cancelled
+
+    def close(self, timeout=None):
+        """Let posts already due fire, then stop the timer thread."""
+        # Posts delayed or backing off could wait an hour, so rather than
+        # outlast a service manager's patience, leave them to the outbox.
+        with self.condition:
+            self.stopping = True
+            now = time.monotonic()
+            waiting = [x for due, _, x in self.heap
+                       if (x.retrying or due > now) and x.cancel(True)]
+            self.condition.notify()
+        if waiting:
+            scheduler_log.warn('Left ' + str(len(waiting)) +
+                               ' delayed or retrying posts for next time')
+        if self.thread:
+            self.thread.join(timeout)
+
+        # Anything still waiting after the timeout will never be posted.
+        with self.condition:
+            abandoned = [x for _, _, x in self.heap if x.cancel(True)]
+            self.heap = []
+            self.keys = {}
+            self.retrying = 0
+        if abandoned:
+            scheduler_log.warn('Abandoned ' + str(len(abandoned)) +
+                               ' scheduled posts')
+
+    def forget(self, post):
+        """Stop tracking a post's key once it has fired or been cancelled."""
+        posts = self.keys.get(post.key, [])
+        if post in posts:
+            posts.remove(post)
+        if not posts:
+            self.keys.pop(post.key, None)
+
+    def push(self, post):
+        """Add a post to the heap and wake the timer thread, lock held."""
+        heapq.heappush(self.heap, (post.due, next(self.order), post))
+        if post.key is not None:
+            self.keys.setdefault(post.key, []).append(post)
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='scheduler',
+                                           daemon=True)
+            self.thread.start()
+        self.condition.notify()
+
+    def requeue(self, post, delay):
+        """Put a failed post back to be retried, if there's room for it."""
+        with self.condition:
+            if self.stopping or post.attempts >= self.attempts:
+                reason = 'closing' if self.stopping else 'out of attempts'
+            elif self.retrying >= self.retries:
+                reason = 'retry queue full'
+            else:
+                post.due = time.monotonic() + delay
+                post.retrying = True
+                self.retrying += 1
+                self.push(post)
+                reason = None
+        if reason:
+            scheduler_log.error('Scheduled post given up, ' + reason)
+            return False
+        scheduler_log.info('Scheduled post retrying in {:.0f}s'.format(delay))
+        return True
+
+    def run(self):
+        """Fire posts as they fall due, until closed with none waiting."""
+        while True:
+            with self.condition:
+                # Sleep until the earliest post is due, or something changes.
+                while self.heap and self.heap[0][2].cancelled:
+                    _, _, post = heapq.heappop(self.heap)
+                    self.retrying -= 1 if post.retrying else 0
+                if not self.heap:
+                    if self.stopping:
+                        return
+                    self.condition.wait()
+                    continue
+                wait = self.heap[0][0] - time.monotonic()
+                if wait > 0:
+                    self.condition.wait(wait)
+                    continue
+                _, _, post = heapq.heappop(self.heap)
+                if post.key is not None:
+                    self.forget(post)
+                if post.retrying:
+                    post.retrying = False
+                    self.retrying -= 1
+
+            # Post outside the lock, so scheduling and cancelling never wait.
+            post.fire()
+
+    def schedule(self, delay, function, *args, key=None):
+        """Run a function after a delay, returning a handle to the post."""
+        post = ScheduledPost(time.monotonic() + delay, function, args, key,
+                             self)
+        with self.condition:
+            if self.stopping:
+                raise RuntimeError('Post scheduler is closed')
+            self.push(post)
+        scheduler_log.debug('Post scheduled in %ss for %s', delay, key)
+        return post
+
+
+class Retry(Exception):
+    """
+    Raised by a scheduled post's function to have it tried again later.
+    """
+
+    def __init__(self, delay, reason=''):
+        """Record how long to wait before trying again, and why."""
+        Exception.__init__(self, reason)
+        self.delay = delay
+
+
+class ScheduledPost(object):
+    """
+    A handle on a post waiting to fire, which can be cancelled or waited on.
+    """
+
+    def __init__(self, due, function, args=(), key=None, scheduler=None):
+        """Record what to run and when, with no result yet."""
+        self.args = args
+        self.attempts = 0
+        self.callbacks = []
+        self.cancelled = False
+        self.due = due
+        self.finished = threading.Event()
+        self.function = function
+        self.given_up = False
+        self.key = key
+        self.lock = threading.Lock()
+        self.result = None
+        self.retrying = False
+        self.scheduler = scheduler
+        self.started = False
+
+    def add_done_callback(self, callback):
+        """Call a function with the post once it has fired or been dropped."""
+        with self.lock:
+            if not self.finished.is_set():
+                self.callbacks.append(callback)
+                return
+        callback(self)
+
+    def cancel(self, given_up=False):
+        """Stop the post firing, returning False if it already has."""
+        with self.lock:
+            if self.started or self.cancelled:
+                return False
+            self.cancelled = True
+            self.given_up = given_up
+        self.finish()
+        return True
+
+    def done(self):
+        """Return whether the post has fired or been cancelled."""
+        return self.finished.is_set()
+
+    def fire(self):
+        """Run the post's function unless it's been cancelled."""
+        with self.lock:
+            if self.cancelled:
+                return
+            self.started = True
+        self.attempts += 1
+        try:
+            self.result = self.function(*self.args)
+
+        # Hand the post back to its scheduler if it asks to be retried.
+        except Retry as retry:
+            with self.lock:
+                self.started = False
+            if self.scheduler is not None and \
+                    self.scheduler.requeue(self, retry.delay):
+                return
+            self.given_up = True
+            self.result = False
+        except Exception as error:
+            scheduler_log.error('Scheduled post failed: ' + str(error))
+            self.result = False
+        self.finish()
+
+    def finish(self):
+        """Mark the post done and call anything waiting on it."""
+        with self.lock:
+            self.finished.set()
+            callbacks, self.callbacks = self.callbacks, []
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as error:
+                scheduler_log.error('Post callback failed: ' + str(error))
+
+    def wait(self, timeout=None):
+        """Wait for the post to fire or be cancelled, returning its result."""
+        self.finished.wait(timeout)
+        return self.result
+
+
+POST_SCHEDULER = PostScheduler()
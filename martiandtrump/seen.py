@@ -0,0 +1,214 @@
+"""
+"""
+import collections
+import hashlib
+import logging
+import math
+import os
+import struct
+import threading
+import time
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+seen_log = logging.getLogger(SCRIPT_NAME + '.seen')
+
+# File layout: a header, the ring of recent IDs, then both filters' bits.
+SEEN_HEADER = struct.Struct('<4sHHIIIIQQ')
+SEEN_MAGIC = b'MDTS'
+SEEN_VERSION = 1
+
+# Seconds between saving the index while new IDs are arriving.
+SEEN_SAVE_INTERVAL = 60
+
+
+def seen_path(name='seen'):
+    """Return the path of a seen index file."""
+    return os.path.join(SCRIPT_DIR, 'cache', name + '.index')
+
+
+def seen_sizes(capacity, error):
+    """Return the bits and hashes a filter needs for an error rate."""
+    bits = -capacity * math.log(error) / math.log(2) ** 2
+    bits = int(math.ceil(bits / 8.0)) * 8
+    hashes = max(1, int(round(bits / float(capacity) * math.log(2))))
+    return bits, hashes
+
+
+class SeenIndex(object):
+    """
+    Remembers recent IDs in a rotating pair of Bloom filters and an exact ring.
+    """
+
+    def __init__(self, path=None, capacity=100000, error=0.000001,
+                 ring=10000):
+        """Load the index saved last time, or start with nothing seen."""
+        self.path = os.path.join(SCRIPT_DIR, path) if path else seen_path()
+        self.capacity = int(capacity)
+        self.bits, self.hashes = seen_sizes(self.capacity, error)
+        self.lock = threading.Lock()
+        self.ring = collections.deque(maxlen=int(ring))
+        self.recent = set()
+        self.checks = 0
+        self.exact = 0
+        self.probable = 0
+        self.dirty = False
+        self.saved = time.monotonic()
+        self.clear()
+        self.load()
+
+    def add(self, body_id):
+        """Remember an ID once it's been handled, saving now and then."""
+        body_id = int(body_id)
+        with self.lock:
+            if body_id in self.recent:
+                return
+            self.insert(body_id, self.positions(body_id))
+            due = time.monotonic() - self.saved > SEEN_SAVE_INTERVAL
+        if due:
+            self.save()
+
+    def check(self, body_id):
+        """Return True if an ID has been seen already, without adding it."""
+        body_id = int(body_id)
+        with self.lock:
+            self.checks += 1
+            if body_id in self.recent:
+                self.exact += 1
+                return True
+
+            # Older IDs are only known to the filters, which might be wrong.
+            positions = self.positions(body_id)
+            if self.contains(self.current, positions) or \
+                    self.contains(self.previous, positions):
+                self.probable += 1
+                return True
+            return False
+
+    def clear(self):
+        """Forget every ID, with the lock held or before it's shared."""
+        self.current = bytearray(self.bits // 8)
+        self.previous = bytearray(self.bits // 8)
+        self.added = 0
+        self.previous_added = 0
+        self.ring.clear()
+        self.recent = set()
+
+    def close(self):
+        """Save the index and log how many duplicates it caught."""
+        self.save()
+        stats = self.stats()
+        message = 'Seen index dropped {} duplicates ({} exact) of {} ' + \
+            'checked, false positive rate ~{:.2g}'
+        seen_log.info(message.format(stats['duplicates'], stats['exact'],
+                                     stats['checks'], stats['rate']))
+
+    def contains(self, bits, positions):
+        """Return True if every bit for an ID is set in a filter."""
+        for position in positions:
+            if not bits[position >> 3] & 1 << (position & 7):
+                return False
+        return True
+
+    def insert(self, body_id, positions):
+        """Remember an ID, rotating the filters when full, lock held."""
+        if self.added >= self.capacity:
+            self.previous, self.previous_added = self.current, self.added
+            self.current = bytearray(self.bits // 8)
+            self.added = 0
+        for position in positions:
+            self.current[position >> 3] |= 1 << (position & 7)
+        self.added += 1
+        if len(self.ring) == self.ring.maxlen:
+            self.recent.discard(self.ring[0])
+        self.ring.append(body_id)
+        self.recent.add(body_id)
+        self.dirty = True
+
+    def load(self):
+        """Read the index saved last time, if it matches this one's sizes."""
+        try:
+            with open(self.path, 'rb') as handle:
+                data = handle.read()
+            header = SEEN_HEADER.unpack_from(data)
+        except FileNotFoundError:
+            return
+        except (OSError, struct.error) as e:
+            seen_log.warn('Seen index unreadable: ' + str(e))
+            return
+        magic, version, hashes, bits, capacity, _, count, added, \
+            previous_added = header
+        if (magic, version) != (SEEN_MAGIC, SEEN_VERSION):
+            seen_log.warn('Not a seen index: ' + self.path)
+            return
+        start = SEEN_HEADER.size
+        ring = struct.unpack_from('<%dQ' % count, data, start)
+        start += 8 * count
+
+        # Filters sized differently are dropped, keeping the exact IDs.
+        size = self.bits // 8
+        if (hashes, bits, capacity) == (self.hashes, self.bits,
+                                        self.capacity) and \
+                len(data) == start + 2 * size:
+            self.current = bytearray(data[start:start + size])
+            self.previous = bytearray(data[start + size:])
+            self.added = added
+            self.previous_added = previous_added
+            for body_id in ring[-self.ring.maxlen:]:
+                self.ring.append(body_id)
+                self.recent.add(body_id)
+        else:
+            seen_log.warn('Seen index resized, keeping recent IDs only')
+            for body_id in ring[-self.ring.maxlen:]:
+                self.insert(body_id, self.positions(body_id))
+        seen_log.info('Seen index loaded with ' + str(len(ring)) +
+                      ' recent IDs')
+
+    def positions(self, body_id):
+        """Return the bits an ID sets, by double hashing one digest."""
+        digest = hashlib.blake2b(body_id.to_bytes(8, 'little'),
+                                 digest_size=16).digest()
+        first = int.from_bytes(digest[:8], 'little')
+        second = int.from_bytes(digest[8:], 'little') | 1
+        return [(first + x * second) % self.bits for x in range(self.hashes)]
+
+    def rate(self):
+        """Return the estimated chance a new ID is wrongly taken as seen."""
+        missed = 1.0
+        for added in (self.added, self.previous_added):
+            filled = 1 - math.exp(-self.hashes * added / float(self.bits))
+            missed *= 1 - filled ** self.hashes
+        return 1 - missed
+
+    def save(self):
+        """Write the index to disk, replacing the last save in one go."""
+        with self.lock:
+            if not self.dirty:
+                return
+            header = SEEN_HEADER.pack(SEEN_MAGIC, SEEN_VERSION, self.hashes,
+                                      self.bits, self.capacity,
+                                      self.ring.maxlen, len(self.ring),
+                                      self.added, self.previous_added)
+            ring = struct.pack('<%dQ' % len(self.ring), *self.ring)
+            data = header + ring + bytes(self.current) + bytes(self.previous)
+            self.dirty = False
+            self.saved = time.monotonic()
+
+        # Write to a temporary file and rename it so a crash never tears it.
+        temporary = self.path + '.' + str(os.getpid())
+        try:
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            with open(temporary, 'wb') as handle:
+                handle.write(data)
+            os.replace(temporary, self.path)
+        except OSError as e:
+            seen_log.error('Seen index save failed: ' + str(e))
+
+    def stats(self):
+        """Return counts of IDs checked and duplicates, and the error rate."""
+        with self.lock:
+            return {'checks': self.checks,
+                    'duplicates': self.exact + self.probable,
+                    'exact': self.exact, 'rate': self.rate(),
+                    'remembered': self.added + self.previous_added}
@@ -0,0 +1,100 @@
+"""
+"""
+import collections
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+from martiandtrump import translator, utils, vocabulary
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+sources_log = logging.getLogger(SCRIPT_NAME + '.sources')
+
+# Translation engines belonging to each shard process, set up once.
+WORKER = {}
+
+
+def sources_load(config_dict, vocab):
+    """Return the accounts and vocab for each source ID in a config."""
+    sources = {
+        int(config_dict['source']['id']): {
+            'account': dict(config_dict['account']),
+            'vocab': vocab,
+        },
+    }
+    if 'sources' not in config_dict:
+        return sources
+
+    # Each further source is "ID = account section, vocab overlay file".
+    for source_id, setting in config_dict['sources'].items():
+        account, _, overlay = [x.strip() for x in setting.partition(',')]
+        account = account if account else 'account'
+        if account not in config_dict:
+            sources_log.error('Source ' + source_id + ' has no [' + account +
+                              '] section, skipped')
+            continue
+        sources[int(source_id)] = {
+            'account': dict(config_dict[account]),
+            'vocab': sources_vocab(vocab, overlay),
+        }
+    sources_log.info('Translating ' + str(len(sources)) + ' sources')
+    return sources
+
+
+def sources_shards(source_ids, shards):
+    """Return the shard each source is translated in, spread evenly."""
+    return {x: idx % shards for idx, x in enumerate(sorted(source_ids))}
+
+
+def sources_start(vocabs, links=None):
+    """Prepare a shard process with an engine for each of its sources."""
+    WORKER['engines'] = {k: translator.TranslationEngine(v, links=links)
+                         for k, v in vocabs.items()}
+
+
+def sources_translate(source_id, text):
+    """Translate a source's text in a shard process."""
+    return WORKER['engines'][source_id].translate(text)
+
+
+def sources_vocab(vocab, overlay=None):
+    """Return a vocab with a config file's vocab laid over the top of it."""
+    if not overlay:
+        return vocab
+    overlay = os.path.join(SCRIPT_DIR, overlay)
+    return collections.ChainMap(vocabulary.vocab_load(overlay), vocab)
+
+
+class ShardPool(object):
+    """
+    Translates each source in one of several processes, keeping caches warm.
+    """
+
+    def __init__(self, sources, shards, links=None):
+        """Start a process per shard, each with its own sources' vocabs."""
+        self.assigned = sources_shards(sources, shards)
+        self.pools = []
+
+        # Forking once the pipeline's threads are running could copy a held
+        # lock into the shard, so they're started from a clean server.
+        # Vocab indexes are sent as their paths and mapped again there.
+        context = multiprocessing.get_context('forkserver')
+        for shard in range(shards):
+            vocabs = {k: v['vocab'] for k, v in sources.items()
+                      if self.assigned[k] == shard}
+            self.pools.append(concurrent.futures.ProcessPoolExecutor(
+                1, mp_context=context, initializer=sources_start,
+                initargs=(vocabs, links)))
+        message = 'Sharded {} sources across {} processes'
+        sources_log.info(message.format(len(sources), shards))
+
+    def close(self):
+        """Stop the shard processes."""
+        for pool in self.pools:
+            pool.shutdown()
+
+    def translate(self, source_id, text):
+        """Translate a source's text in its shard, waiting for the result."""
+        pool = self.pools[self.assigned[source_id]]
+        return pool.submit(sources_translate, source_id, text).result()
@@ -1,32 +1,63 @@
 """
 """
+import functools
 import logging
+import threading
 import tweepy
-from martiandtrump import translator, twitter, utils
+from martiandtrump import outbox, pipeline, posted, replay, scheduler, seen
+from martiandtrump import sources, translator, twitter, utils
 
 
 SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
 stream_log = logging.getLogger(SCRIPT_NAME + '.streamer')
 
+# Seconds before posts given up on are tried again, if still connected.
+RESEND_DELAY = 600
 
-def start(source_id, tweeting_config, listener_config=None, vocab={}):
+
+def connect(listener_auth, translator):
+    """Follow every source over one stream connection until it drops."""
+    translator.resend()  # Posts given up on since the last connection.
+    stream = tweepy.Stream(listener_auth, translator)
+    try:
+        stream.filter(follow=[str(x) for x in translator.source_ids])
+        return True
+
+    # Catch and log any exceptions ending the stream.
+    except Exception as error:
+        stream_log.error('Streamer error: ' + str(error))
+        return False
+
+
+def start(source_id, tweeting_config, listener_config=None, vocab={},
+          results=None, pipeline_config={}, limits_config={}, others={},
+          supervisor=None):
     """Handle authentication and startup of the streaming translator."""
     stream_log.debug('Stream starting')
     try:
         # Handle authentication of tweeting and listening accounts.
-        tweeting_auth = twitter.authenticate(**tweeting_config)
+        tweeting_auth = twitter.client(tweeting_config, limits_config).auth
         listener_auth = tweeting_auth
         if listener_config:
-            listener_auth = twitter.authenticate(**listener_config)
+            listener_auth = twitter.client(listener_config).auth
             # TODO; handle errors gracefully.
 
-        # Prepare and run the real-time streamer, filtering on the source_id.
-        translator = StreamTranslator(tweeting_auth, source_id, vocab)
-        thisStream = tweepy.Stream(listener_auth, translator)
-        thisStream.filter(follow=[source_id])
-        return True
+        # Prepare and run the real-time streamer, following every source.
+        translator = StreamTranslator(tweeting_auth, source_id, vocab,
+                                      results, pipeline_config, limits_config,
+                                      others)
+        try:
+            if supervisor is None:
+                return connect(listener_auth, translator)
+
+            # Or keep reconnecting the same translator, its caches warm.
+            supervisor.run(functools.partial(connect, listener_auth,
+                                             translator))
+            return True
+        finally:
+            translator.close()
 
-    # Catch and log any exceptions occurring during streamer startup and run.
+    # Catch and log any exceptions occurring during streamer startup.
     except Exception as error:
         stream_log.error('Streamer error: ' + str(error))
         return False
@@ -36,29 +67,213 @@ class StreamTranslator(tweepy.StreamListener):
     """
     """
 
-    def __init__(self, tweeting_auth, source_id, vocab):
+    def __init__(self, tweeting_auth, source_id, vocab, results=None,
+                 pipeline_config={}, limits_config={}, others={},
+                 links=None):
         """Log the stream initializing and apply arguments to self."""
         stream_log.debug('Stream initializing')
         tweepy.StreamListener.__init__(self)
-        self.account = tweepy.API(tweeting_auth)
+        self.account = twitter.client(tweeting_auth)
         self.source_id = int(source_id)
         self.vocab = vocab
+        self.engine = translator.TranslationEngine(vocab, links=links,
+                                                   results=results)
+        retries = int(limits_config.get('retries', 100))
+        self.posts = scheduler.PostScheduler(retries)
 
-    def on_data(self, event):
-        """Respond to events returned by the stream."""
-        this = twitter.parse(event, only=[self.source_id])
-        action_needed = this and this['user_id'] == self.source_id
+        # Index each source's account and engine by its ID for dispatching.
+        self.sources = {self.source_id: {'account': self.account,
+                                         'engine': self.engine,
+                                         'vocab': vocab}}
+        for other_id, source in others.items():
+            if int(other_id) == self.source_id:
+                continue
+            self.sources[int(other_id)] = {
+                'account': twitter.client(source['account'], limits_config),
+                'engine': translator.TranslationEngine(source['vocab'],
+                                                       links=links,
+                                                       results=results),
+                'vocab': source['vocab'],
+            }
+        self.source_ids = sorted(self.sources)
 
-        # Respond to any tweets or tweet quotations.
-        if action_needed and this['type'] in ['tweet', 'quoted_tweet']:
-            translation = translator.translate(this['body'], self.vocab)
-            twitter.tweet(self.account, translation)
+        # Stages handling events away from the thread reading the stream.
+        setting = pipeline_config.get
+        stages = [
+            ('parse', self.parse, setting('parsers', 1)),
+            ('translate', self.translate, setting('translators', 1)),
+            ('post', self.post, setting('posters', 1)),
+        ]
+        size = int(setting('queue', 100))
+        interval = int(setting('interval', 60))
+        self.delay = setting('delay', 0)
+        self.delay_variance = setting('delay_variance', 0)
+        record = setting('record')
+        self.recorder = replay.EventRecorder(record) if record else None
 
-        # Retweet the same retweets.
-#        if action_needed and this['type'] == 'retweet':
-#            twitter.retweet(self.account, this['body_id'])
+        # Translate in processes of their own if one core isn't enough.
+        processes = int(setting('processes', 0) or 0)
+        self.shards = None
+        if processes > 0:
+            self.shards = sources.ShardPool(self.sources, processes, links)
+
+        # Remember tweets already handled, across reconnects and restarts,
+        # and ones being handled now, so a redelivery is only handled once.
+        capacity = int(setting('seen_capacity', 100000) or 100000)
+        self.seen = seen.SeenIndex(setting('seen'), capacity)
+        self.handling = set()
+        self.handling_lock = threading.Lock()
+
+        # Remember what each translation was posted as, to delete it later.
+        window = int(setting('posted_window', 604800) or 604800)
+        self.posted = posted.PostedMap(setting('posted'), window)
+
+        # Send anything left unsent last time before taking on anything new.
+        self.outbox = outbox.Outbox(setting('outbox'))
+        self.unsent = set()
+        self.unsent_lock = threading.Lock()
+        self.unsent_timer = None
+        pending = self.outbox.pending()
+        for entry in pending:
+            if entry['key'] is not None:
+                self.seen.add(entry['key'])
+        self.resend(pending)
+        self.pipeline = pipeline.Pipeline(stages, size, interval)
+
+    def close(self):
+        """Let events received finish, leaving delayed posts to the outbox."""
+        self.pipeline.stop()
+        with self.unsent_lock:
+            if self.unsent_timer is not None:
+                self.unsent_timer.cancel()
+        self.posts.close()
+        self.outbox.close()
+        self.seen.close()
+        self.posted.close()
+        if self.shards:
+            self.shards.close()
+        if self.recorder:
+            self.recorder.close()
+
+    def deleted(self, body_id, post):
+        """Forget a translation once it's been deleted along with its tweet."""
+        if post.result:
+            self.posted.pop(body_id)
+
+    def handled(self, body_id):
+        """Stop treating a tweet as being handled, done with or not."""
+        with self.handling_lock:
+            self.handling.discard(body_id)
+
+    def on_data(self, event):
+        """Queue events returned by the stream, and get straight back to it."""
+        if self.recorder:
+            self.recorder.record(event)
+
+        # Only queue events which could concern a source, so noise from
+        # other accounts never takes up room meant for source tweets.
+        if twitter.parse_candidate(event, self.source_ids, ['retweet']):
+            self.pipeline.submit(event)
 
     def on_error(self, error):
         """Capture and log any stream errors."""
         stream_log.error('Stream error: ' + str(error))
         # Let tweepy handle 420 throttling behaviour.
+
+    def parse(self, event):
+        """Parse an event, returning it if it's one needing translation."""
+        this = twitter.parse(event, only=self.source_ids)
+        source_id = this['user_id'] if this else None
+        action_needed = source_id in self.sources
+
+        # Respond to any tweets or tweet quotations not already handled.
+        # Tweets are only remembered once posted, so check without adding.
+        if action_needed and this['type'] in ['tweet', 'quoted_tweet']:
+            body_id = this['body_id']
+            with self.handling_lock:
+                duplicate = body_id in self.handling or \
+                    self.seen.check(body_id)
+                if not duplicate:
+                    self.handling.add(body_id)
+            if duplicate:
+                stream_log.debug('Duplicate dropped: %s', body_id)
+                return None
+            return source_id, this
+
+        # Don't post translations of deleted tweets, or delete them if posted.
+        if action_needed and this['type'] == 'delete':
+            self.posts.cancel(this['body_id'])
+            posted_id = self.posted.get(this['body_id'])
+            if posted_id is not None:
+                account = self.sources[source_id]['account']
+                post = self.posts.schedule(0, twitter.delete, account,
+                                           posted_id)
+                post.add_done_callback(functools.partial(self.deleted,
+                                                         this['body_id']))
+
+        # Retweet the same retweets.
+#        if action_needed and this['type'] == 'retweet':
+#            account = self.sources[source_id]['account']
+#            twitter.retweet(account, this['body_id'])
+        return None
+
+    def post(self, translated):
+        """Post or schedule a translation once it's safely in the outbox."""
+        source_id, body_id, translation = translated
+        account = self.sources[source_id]['account']
+        try:
+            entry = self.outbox.add(translation, body_id, source=source_id)
+            self.seen.add(body_id)
+        finally:
+            self.handled(body_id)
+        post = twitter.tweet(account, translation, delay=self.delay,
+                             delay_variance=self.delay_variance, key=body_id,
+                             posts=self.posts, posted=self.posted)
+        post.add_done_callback(functools.partial(self.sent, entry))
+        return post
+
+    def resend(self, entries=None):
+        """Schedule outbox entries again, by default ones given up on."""
+        if entries is None:
+            with self.unsent_lock:
+                unsent, self.unsent = self.unsent, set()
+                self.unsent_timer = None
+            entries = [x for x in self.outbox.pending() if x['id'] in unsent]
+        if entries:
+            stream_log.info('Resending ' + str(len(entries)) + ' posts')
+        for entry in entries:
+            source = self.sources.get(entry.get('source'),
+                                      self.sources[self.source_id])
+            post = self.posts.schedule(0, twitter.tweet_post,
+                                       source['account'], entry['body'],
+                                       entry['reply_to'], entry['key'],
+                                       self.posted, key=entry['key'])
+            post.add_done_callback(functools.partial(self.sent, entry))
+
+    def sent(self, entry, post):
+        """Clear a post from the outbox unless it's been left for next time."""
+        if not post.given_up:
+            self.outbox.ack(entry['id'])
+            return
+        with self.unsent_lock:
+            self.unsent.add(entry['id'])
+            if self.unsent_timer is None and not self.posts.stopping:
+                self.unsent_timer = threading.Timer(RESEND_DELAY, self.resend)
+                self.unsent_timer.daemon = True
+                self.unsent_timer.start()
+
+    def translate(self, parsed):
+        """Translate the body of a parsed event, keeping where it's from."""
+        source_id, this = parsed
+        try:
+            if self.shards:
+                translation = self.shards.translate(source_id, this['body'])
+            else:
+                engine = self.sources[source_id]['engine']
+                translation = engine.translate(this['body'])
+
+        # Let a redelivery of a tweet that failed to translate try again.
+        except Exception:
+            self.handled(this['body_id'])
+            raise
+        return source_id, this['body_id'], translation
@@ -1,6 +1,7 @@
 """
 """
 import datetime
+import fcntl
 import json
 import logging
 import os
@@ -13,13 +14,169 @@ from martiandtrump import utils
 SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
 system_log = logging.getLogger(SCRIPT_NAME + '.system')
 
+# Bytes read at a time when reading a cache log backwards from its end.
+CACHE_BLOCK_BYTES = 4096
+
+# Size a cache log can reach before it's worth compacting.
+CACHE_COMPACT_BYTES = 65536
+
+# Version of the header starting each cache log.
+CACHE_VERSION = 1
+
+
+def cache_add(handle, record):
+    """Append a record to a locked cache log, compacting it if it's due."""
+    handle.write(json.dumps(record, sort_keys=True) + '\n')
+    handle.flush()
+    os.fsync(handle.fileno())
+
+    # Compact once the log has doubled since it was last compacted.
+    size = os.fstat(handle.fileno()).st_size
+    handle.seek(0)
+    header = cache_header(handle.readline())
+    if size > CACHE_COMPACT_BYTES and size > 2 * header['compacted']:
+        cache_compact(handle)
+    return True
+
+
+def cache_append(cache_type, record):
+    """Append one record to a list cache and return True/False on success."""
+    try:
+        with cache_open(cache_type) as handle:
+            return cache_add(handle, {'add': record})
+    except IOError as e:
+        system_log.error('Cache append failed: ' + str(e))
+        return False
+
+
+def cache_compact(handle):
+    """Rewrite a locked cache log with only what a read would return."""
+    handle.seek(0)
+    found, data = cache_fold(handle)
+    records = []
+    if found and isinstance(data, list):
+        records = [{'set': []}] + [{'add': x} for x in data]
+    elif found:
+        records = [{'set': data}]
+    lines = [json.dumps(x, sort_keys=True) + '\n' for x in records]
+
+    # Write to a temporary file and rename it so readers never see half.
+    path = handle.name
+    size = sum(len(x.encode('utf-8')) for x in lines)
+    header = json.dumps({'cache': CACHE_VERSION, 'compacted': size})
+    temporary = path + '.' + str(os.getpid())
+    with open(temporary, 'w', encoding='utf-8') as compacted:
+        compacted.write(header + '\n' + ''.join(lines))
+        compacted.flush()
+        os.fsync(compacted.fileno())
+    os.replace(temporary, path)
+    system_log.debug('Cache compacted: ' + path)
+
 
 def cache_file(cache_type):
     """"""
     return os.path.join(SCRIPT_DIR, 'cache', cache_type + '.json')
 
 
+def cache_fold(lines):
+    """Return whether a cache log holds anything, and what it holds."""
+    found, data = False, None
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            continue  # A torn last line is a write that never finished.
+        if 'set' in record:
+            found, data = True, record['set']
+        elif 'add' in record:
+            data = data if found and isinstance(data, list) else []
+            found = True
+            data.append(record['add'])
+    return found, data
+
+
+def cache_header(line):
+    """Return the header of a cache log, or a blank one if it's missing."""
+    try:
+        header = json.loads(line)
+    except ValueError:
+        header = {}
+    if not isinstance(header, dict) or 'cache' not in header:
+        header = {'cache': CACHE_VERSION, 'compacted': 0}
+    return header
+
+
+def cache_lines_reversed(handle):
+    """Yield the lines of a binary file from last to first."""
+    handle.seek(0, os.SEEK_END)
+    position = handle.tell()
+    partial = b''
+    while position > 0:
+        size = min(CACHE_BLOCK_BYTES, position)
+        position -= size
+        handle.seek(position)
+        lines = (handle.read(size) + partial).split(b'\n')
+        partial = lines.pop(0)
+        for line in reversed(lines):
+            if line:
+                yield line
+    if partial:
+        yield partial
+
+
+def cache_log(cache_type):
+    """Return the path of the append-only log behind a cache."""
+    return os.path.join(SCRIPT_DIR, 'cache', cache_type + '.jsonl')
+
+
+def cache_open(cache_type):
+    """Open a cache log for appending, locked against other writers."""
+    path = cache_log(cache_type)
+    directory, _, _ = path_parts(path)
+    path = dir_check(directory, SCRIPT_DIR) + path[len(directory):]
+
+    # Lock the log, opening it again if it was compacted meanwhile.
+    while True:
+        handle = open(path, 'a+', encoding='utf-8')
+        fcntl.flock(handle, fcntl.LOCK_EX)
+        if os.path.exists(path) and \
+                os.path.samestat(os.fstat(handle.fileno()), os.stat(path)):
+            break
+        handle.close()
+
+    # Start a new log with a header, carrying over any old JSON cache.
+    if os.fstat(handle.fileno()).st_size == 0:
+        header = {'cache': CACHE_VERSION, 'compacted': 0}
+        handle.write(json.dumps(header) + '\n')
+        legacy = cache_file(cache_type)
+        if os.path.exists(legacy):
+            try:
+                with open(legacy, 'r') as old:
+                    data = json.load(old)
+                handle.write(json.dumps({'set': data}, sort_keys=True) + '\n')
+                system_log.info('Cache carried over from ' + legacy)
+            except (IOError, json.decoder.JSONDecodeError) as e:
+                system_log.warn('Old cache unreadable: ' + str(e))
+        handle.flush()
+    return handle
+
+
 def cache_read(cache_type, default=None):
+    """Read a cache log and return the stored data."""
+    cache = cache_log(cache_type)
+    if not os.path.exists(cache):
+        return cache_read_json(cache_type, default)
+    try:
+        with open(cache, 'r', encoding='utf-8') as handle:
+            found, data = cache_fold(handle)
+        system_log.info('Cache read OK: ' + cache)
+        return data if found else default
+    except IOError as e:
+        system_log.error('Cache read failed: ' + str(e))
+        return default
+
+
+def cache_read_json(cache_type, default=None):
     """Read a JSON cache file and return the stored dictionary."""
     cache = cache_file(cache_type)
     try:
@@ -32,29 +189,54 @@ def cache_read(cache_type, default=None):
         return default
 
 
+def cache_tail(cache_type, count=1, default=None):
+    """Return the last few records of a list cache, reading from the end."""
+    cache = cache_log(cache_type)
+    if not os.path.exists(cache):
+        data = cache_read(cache_type)
+        return data[-count:] if isinstance(data, list) else default
+    tail = []
+    try:
+        with open(cache, 'rb') as handle:
+            for line in cache_lines_reversed(handle):
+                try:
+                    record = json.loads(line.decode('utf-8'))
+                except ValueError:
+                    continue
+                if 'add' in record:
+                    tail.insert(0, record['add'])
+                elif 'set' in record:
+                    data = record['set']
+                    if isinstance(data, list) and len(tail) < count:
+                        tail = data[len(tail) - count:] + tail
+                    break
+                if len(tail) >= count:
+                    break
+    except IOError as e:
+        system_log.error('Cache read failed: ' + str(e))
+        return default
+    return tail if tail else default
+
+
 def cache_write(cache_type, payload, clobber=False):
-    """Write a JSON cache file and return True/False based on success."""
-    cache = cache_file(cache_type)
-    directory, name, _ = path_parts(cache)
-    directory_proper = dir_check(directory, SCRIPT_DIR)
-    cache = directory_proper + cache[len(directory):]
-    success, text = (False, 'Cache write failed: ' + cache + ' (unsafe)')
-    lock_name = '-'.join([cache_type, 'cache'])
-    ready = clobber or not os.path.exists(cache)
-    if lock(lock_name) and ready:
-    
-        # Write the cache file and log success.
-        try:
-            with open(cache, 'w') as handle:
-                json.dump(payload, handle, indent=2, sort_keys=True)
-            lock_break(lock_name)
-            system_log.debug('Cache written OK: ' + cache)
-            return True
+    """Write to a cache and return True/False based on success."""
+    cache = cache_log(cache_type)
+    exists = os.path.exists(cache) or os.path.exists(cache_file(cache_type))
+    if exists and not clobber:
+        system_log.error('Cache write failed: ' + cache + ' (unsafe)')
+        return False
 
-        # Log an errors which occurred during the cahe write.
-        except IOError as e:
-            system_log.error('Cache write failed: ' + str(e))
-            return False
+    # Append the new data, superseding whatever the log held before.
+    try:
+        with cache_open(cache_type) as handle:
+            cache_add(handle, {'set': payload})
+        system_log.debug('Cache written OK: ' + cache)
+        return True
+
+    # Log an errors which occurred during the cahe write.
+    except IOError as e:
+        system_log.error('Cache write failed: ' + str(e))
+        return False
 
 
 def command_run(command):
@@ -232,7 +414,7 @@ def power_get():
         'state': 'OK',
         'time': datetime.datetime.utcnow(),
     }
-    power = cache_read('power', [dict(default)])
+    power = cache_tail('power', 1, [dict(default)])
     power = power[-1] if isinstance(power, list) and len(power) else default
     power = {
         'state': power.get('state', default['state']),
@@ -251,9 +433,7 @@ def power_set(state):
     }
     report = system_log.info if state == 'OK' else system_log.warn
     report('Power set to ' + now['state'])
-    cache = cache_read('power', [])
-    cache.append(dict(now))
-    return cache_write('power', cache, clobber=True)
+    return cache_append('power', dict(now))
 
 
 def service_change(service, verb):
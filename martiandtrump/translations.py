@@ -0,0 +1,143 @@
+"""
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import threading
+import time
+from martiandtrump import utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+translations_log = logging.getLogger(SCRIPT_NAME + '.translations')
+
+# Writes between size checks, counting rows isn't free.
+EVICT_EVERY = 100
+
+# Seconds a translation's last use can be out by, and hits saved up before
+# writing them, so reads needn't wait for other processes' writes.
+TOUCH_AFTER = 60
+TOUCH_EVERY = 100
+
+
+def translations_key(text, version, limit):
+    """Return a digest identifying a text translated by a vocab version."""
+    key = '\0'.join([text, str(version), str(limit)])
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()
+
+
+def translations_path(name='translations'):
+    """Return the path of a translation cache database."""
+    return os.path.join(SCRIPT_DIR, 'cache', name + '.sqlite')
+
+
+class TranslationCache(object):
+    """
+    Remembers finished translations on disk, shared between processes.
+    """
+
+    def __init__(self, path=None, size=10000, timeout=5):
+        """Open or create the cache database in write-ahead log mode."""
+        self.path = path if path else translations_path()
+        self.size = size
+        self.writes = 0
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+        self.touched = {}
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        translations_log.info('Translation cache opening: ' + self.path)
+
+        # Readers in other processes aren't blocked by a writer in WAL mode.
+        self.db = sqlite3.connect(self.path, timeout=timeout,
+                                  check_same_thread=False)
+        self.db.execute('PRAGMA journal_mode=WAL')
+        self.db.execute('PRAGMA synchronous=NORMAL')
+        with self.db:
+            self.db.execute('CREATE TABLE IF NOT EXISTS translations ('
+                            'key TEXT PRIMARY KEY, translation TEXT NOT NULL,'
+                            ' used REAL NOT NULL)')
+            self.db.execute('CREATE INDEX IF NOT EXISTS translations_used '
+                            'ON translations (used)')
+
+    def close(self):
+        """Record any saved up hits and close the cache database."""
+        with self.lock:
+            try:
+                with self.db:
+                    self.touch()
+            except sqlite3.Error as e:
+                translations_log.warn('Translation cache write failed: ' +
+                                      str(e))
+            self.db.close()
+
+    def evict(self):
+        """Forget the least recently used translations beyond the size cap."""
+        count = self.db.execute('SELECT COUNT(*) FROM translations')
+        excess = count.fetchone()[0] - self.size
+        if excess > 0:
+            self.db.execute('DELETE FROM translations WHERE key IN (SELECT key'
+                            ' FROM translations ORDER BY used LIMIT ?)',
+                            (excess,))
+            translations_log.debug('Translation cache evicted %s', excess)
+
+    def get(self, text, version, limit=280):
+        """Return a remembered translation and mark it used, or None."""
+        key = translations_key(text, version, limit)
+        try:
+            with self.lock:
+                row = self.db.execute('SELECT translation, used FROM'
+                                      ' translations WHERE key = ?',
+                                      (key,)).fetchone()
+
+        # A busy or broken cache just means translating again.
+        except sqlite3.Error as e:
+            translations_log.warn('Translation cache read failed: ' + str(e))
+            row = None
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+
+        # Save up hits on stale entries to mark them used a batch at a time.
+        now = time.time()
+        if row[1] < now - TOUCH_AFTER:
+            with self.lock:
+                self.touched[key] = now
+                if len(self.touched) >= TOUCH_EVERY:
+                    try:
+                        with self.db:
+                            self.touch()
+                    except sqlite3.Error as e:
+                        translations_log.debug('Translation cache touch '
+                                               'failed: %s', e)
+        return row[0]
+
+    def put(self, text, version, translation, limit=280):
+        """Remember a translation, evicting old ones if the cache is full."""
+        key = translations_key(text, version, limit)
+        try:
+            with self.lock, self.db:
+                self.db.execute('INSERT OR REPLACE INTO translations VALUES'
+                                ' (?, ?, ?)', (key, translation, time.time()))
+                self.touch()
+                self.writes += 1
+                if self.writes % EVICT_EVERY == 0:
+                    self.evict()
+            return True
+        except sqlite3.Error as e:
+            translations_log.warn('Translation cache write failed: ' + str(e))
+            return False
+
+    def stats(self):
+        """Return hit/miss counters for the cache."""
+        return {'hits': self.hits, 'misses': self.misses, 'limit': self.size}
+
+    def touch(self):
+        """Mark saved up hits used, in a transaction with the lock held."""
+        touched, self.touched = self.touched, {}
+        if touched:
+            self.db.executemany('UPDATE translations SET used = ? WHERE'
+                                ' key = ?', [(v, k) for k, v in
+                                             touched.items()])
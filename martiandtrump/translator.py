@@ -1,14 +1,26 @@
 """
 """
+import bisect
+import collections
+import hashlib
+import heapq
+import itertools
 import logging
 import re
-import requests
-from martiandtrump import utils
+import string
+from martiandtrump import resolver, utils
 
 
 SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
 translate_log = logging.getLogger(SCRIPT_NAME + '.translator')
 
+# Vocabs the module functions keep an engine for, least recent forgotten.
+ENGINES_KEPT = 16
+
+# Shortest vocab words matched within a token, and shortest leftovers.
+SEGMENT_WORD = 4
+SEGMENT_REST = 2
+
 
 def case_mimic(token, example):
     """Attempt to replicate the spirit of an example's capitalization."""
@@ -21,8 +33,7 @@ def case_mimic(token, example):
 
 def deduplicate_tokens(tokens, limit=280):
     """Attempt to prune repeating tokens as conservatively as possible."""
-    text = ''.join(tokens)
-    length = len(text)
+    length = sum(len(x) for x in tokens)
     excess = length - limit
     if excess < 0:
         return tokens
@@ -31,30 +42,27 @@ def deduplicate_tokens(tokens, limit=280):
     duplicates = []
     idx = 0
     salvageable_chars = 0
-    search = list(tokens)
-    while search:
+    end = len(tokens) - 3  # Comparing pairs needs four tokens.
+    while idx < end:
 
-        # Move on if there's no search space or duplication.
-        if len(search) < 4:
-            break
-        if search[:2] != search[2:4]:
-            search.pop(0)
+        # Move on if there's no duplication.
+        if tokens[idx] != tokens[idx + 2] or \
+                tokens[idx + 1] != tokens[idx + 3]:
             idx = idx + 1
             continue
 
         # Found a duplicate, keep searching until the chain stops.
         duplicated = []
-        while search[:2] == search[2:4]:
-            unit = ''.join(search[:2])
-            salvage = len(unit)
+        while idx < end and tokens[idx] == tokens[idx + 2] and \
+                tokens[idx + 1] == tokens[idx + 3]:
+            salvage = len(tokens[idx]) + len(tokens[idx + 1])
             duplicated.append((idx, salvage))
             salvageable_chars = salvageable_chars + salvage
-            search = search[2:]
             idx = idx + 2
         duplicates.append(duplicated)
 
-    message = 'Token deduplication can salvage ' + str(salvageable_chars)
-    translate_log.debug(message)
+    message = 'Token deduplication can salvage %s'
+    translate_log.debug(message, salvageable_chars)
 
     # If salvage won't be enough, deduplicate everything to reduce deletions.
     if length - salvageable_chars >= limit:
@@ -73,14 +81,12 @@ def deduplicate_tokens(tokens, limit=280):
             salvage[1] += duplicates[salvage[0]][1]  # Total salvaged.
             salvage[0] += 1  # Last idx tuple to salvage.
         duplicates = sorted([idx for idx, _ in duplicates[:salvage[0]]])
-        translate_log.debug('Token deduplication salvaged ' + str(salvage[1]))
+        translate_log.debug('Token deduplication salvaged %s', salvage[1])
 
-    # Remove the identified duplicates from the list of tokens.
-    modifier = 0
-    for idx in duplicates:
-        idx -= modifier
-        del tokens[idx:idx + 2]
-        modifier += 2
+    # Remove the identified duplicates from the list of tokens in one pass.
+    doomed = set(duplicates)
+    doomed.update([idx + 1 for idx in duplicates])
+    tokens[:] = [x for idx, x in enumerate(tokens) if idx not in doomed]
 
     # Report and return the list of deduplicated tokens
     translate_log.warn('Tokens deduplicated to: ' + ''.join(tokens))
@@ -89,46 +95,157 @@ def deduplicate_tokens(tokens, limit=280):
 
 def delete_tokens(tokens, limit=280, changes={}):
     """Attempt to remove tokens as little as possible."""
-    text = ''.join(tokens)
-    length = len(text)
+    length = sum(len(x) for x in tokens)
     excess = length - limit
     if excess < 0:
         return tokens
-    translate_log.debug('Tokens will be deleted to salvage ' + str(excess))
+    translate_log.debug('Tokens will be deleted to salvage %s', excess)
 
-    # Get a list of translated tokens, sorted by size from small to large.
+    # Get a heap of translated tokens, popping by size from small to large.
+    # Tokens still appearing after a deletion go around again in later rounds.
     expendable = [v for k, v in changes.items() if v == v.lower()]
     expendable = [x for x in expendable if x == x.strip(".,'-")]
-    expendable = sorted(expendable, key=len)
+    expendable = [(0, len(x), n, x) for n, x in enumerate(expendable)]
+    heapq.heapify(expendable)
+
+    # Index where each expendable token appears, and link up neighbours.
+    positions = {x: [] for _, _, _, x in expendable}
+    for idx, token in enumerate(tokens):
+        if token in positions:
+            positions[token].append(idx)
+    surviving = {x: len(positions[x]) for x in positions}
+    before = list(range(-1, len(tokens) - 1))
+    after = list(range(1, len(tokens) + 1))
+    deleted = [False] * len(tokens)
 
     # Remove pairs of expendable tokens until no excess remains.
     offset = 0
-    while excess > 1:
-        victim = expendable.pop(0)
-        idx = tokens[offset:].index(victim)
-        if idx != 0 and tokens[idx - 1] == ' ':
-            idx = idx - 1
-        idx = idx + offset
-        victims = tokens[idx:idx + 2]
-        del tokens[idx:idx + 2]
-        translate_log.debug('Tokens deleted: <' + '> <'.join(victims) + '>')
-        salvaged = len(''.join(victims))
+    while excess > 1 and expendable:
+        rounds, size, order, victim = heapq.heappop(expendable)
+        idx = delete_tokens_find(positions[victim], deleted, offset)
+        if idx is None:
+            continue
+
+        # Take the space before the victim, or whatever follows it.
+        if before[idx] >= 0 and tokens[before[idx]] == ' ':
+            victims = [before[idx], idx]
+        elif after[idx] < len(tokens):
+            victims = [idx, after[idx]]
+        else:
+            victims = [idx]
+
+        # Tombstone the victims and unlink them from their neighbours.
+        for x in victims:
+            deleted[x] = True
+            if tokens[x] in surviving:
+                surviving[tokens[x]] -= 1
+            if before[x] >= 0:
+                after[before[x]] = after[x]
+            if after[x] < len(tokens):
+                before[after[x]] = before[x]
+        if surviving[victim]:
+            heapq.heappush(expendable, (rounds + 1, size, order, victim))
+        victims_text = [tokens[x] for x in victims]
+        translate_log.debug('Tokens deleted: <%s>', '> <'.join(victims_text))
+        salvaged = sum(len(x) for x in victims_text)
         excess = excess - salvaged
-        translate_log.debug('Token deletion salvaged ' + str(salvaged))
-        offset = idx
+        translate_log.debug('Token deletion salvaged %s', salvaged)
+        offset = victims[0]
+
+    # Report running out of expendable tokens before reaching the limit.
+    if excess > 1:
+        translate_log.warn('Token deletion ran out of tokens to delete')
 
     # Report and return the list of condensed tokens
+    tokens[:] = [x for idx, x in enumerate(tokens) if not deleted[idx]]
     translate_log.warn('Tokens deleted to: ' + ''.join(tokens))
     return tokens
 
 
-def syllables(token):
+def delete_tokens_find(positions, deleted, offset):
+    """Return the first surviving position after an offset, or before it."""
+    start = bisect.bisect_left(positions, offset)
+    for idx in itertools.chain(range(start, len(positions)), range(start)):
+        if not deleted[positions[idx]]:
+            return positions[idx]
+    return None
+
+
+def segments(token, trie):
+    """Split a token into vocab words, letter runs, and other characters."""
+    lookup = token.lower()
+    parts = []
+    idx = 0
+    while idx < len(token):
+
+        # Anything but a run of several letters stands alone.
+        run = idx
+        while run < len(token) and token[run] in string.ascii_letters:
+            run = run + 1
+        if run - idx < 2:
+            parts.append(token[idx])
+            idx = idx + 1
+            continue
+
+        # Take the longest vocab words from left to right, gathering the
+        # letters between them into spans to be translated whole.
+        pending = idx
+        while idx < run:
+            match = None
+            gap = idx - pending
+            if gap == 0 or gap >= SEGMENT_REST:
+                match = segments_match(trie, lookup, idx, run, gap == 0)
+            if match is None:
+                idx = idx + 1
+                continue
+            if gap:
+                parts.append(token[pending:idx])
+            parts.append(token[idx:match])
+            idx = pending = match
+        if pending < run:
+            parts.append(token[pending:run])
+    return parts
+
+
+def segments_match(trie, lookup, start, end, whole=True):
+    """Return where the longest sensible vocab word from start ends."""
+    node = trie
+    match = None
+    for idx in range(start, end):
+        node = node.get(lookup[idx])
+        if node is None:
+            break
+
+        # Whole remainders can match, otherwise avoid silly fragments.
+        finish = idx + 1
+        rest = end - finish
+        sensible = finish - start >= SEGMENT_WORD
+        sensible = sensible and (rest == 0 or rest >= SEGMENT_REST)
+        if None in node and (sensible or whole and rest == 0):
+            match = finish
+    return match
+
+
+def segments_trie(vocab):
+    """Return a character trie of the vocab words made only of letters."""
+    trie = {}
+    for word in vocab:
+        if not word.isalpha() or not word.isascii():
+            continue
+        node = trie
+        for character in word.lower():
+            node = node.setdefault(character, {})
+        node[None] = True  # Marks the end of a word.
+    return trie
+
+
+def syllables(token, edgecases=None):
     """Return the probable number of syllables in a supplied token."""
     # Full disclosure: I can't remember where I found this, sorry.
     # It was way back in the day when I used Perl every day in my job.
     # It's been updated, mutated, ruined, and refactored beyond memory since.
     # I was young, naive, and mostly drunk.
-    translate_log.debug('Syllable guessing for token: <' + token + '>')
+    translate_log.debug('Syllable guessing for token: <%s>', token)
 
     # Uncountable tokens have simple results returned quickly.
     if token.strip() == '':
@@ -148,21 +265,30 @@ def syllables(token):
     consonant_groups = filter(None, consonant_groups)
     consonant_groups = list(consonant_groups)
     result = len(consonant_groups)
-    translate_log.debug('Token consonant groups: ' + str(result))
+    translate_log.debug('Token consonant groups: %s', result)
 
     # Some edge-cases affect the number of syllables further.
-    for case, modifier in syllables_edgecases():
-        if re.match(case, test):
-            translate_log.debug('Token edge-case: ' + case + ' ' + str(modifier))
+    if edgecases is None:
+        edgecases = syllables_compiled()
+    for case, modifier in edgecases:
+        if case.match(test):
+            message = 'Token edge-case: %s %s'
+            translate_log.debug(message, case.pattern, modifier)
             result += modifier
 
     # Report and return guessed number of syllables.
     if result < 1:
         result = 1
-    translate_log.debug('Token <' + token + '> syllables: ' + str(result))
+    translate_log.debug('Token <%s> syllables: %s', token, result)
     return result
 
 
+def syllables_compiled():
+    """Return the syllable edge-cases with their patterns compiled."""
+    edgecases = syllables_edgecases()
+    return [(re.compile(case), modifier) for case, modifier in edgecases]
+
+
 def syllables_edgecases():
     """Return a list of tuples for edge-case matching and score modifiers."""
     return [
@@ -195,15 +321,16 @@ def syllables_edgecases():
     ]
 
 
-def syllables_repeat(string, repeat='ack'):
+def syllables_repeat(string, repeat='ack', counter=syllables):
     """Repeat a string for the same number of syllables as a given token."""
-    return repeat * syllables(string)
+    return repeat * counter(string)
 
 
 def tokenize(text):
     """Return a list of words and whitespaces from a given text string."""
     tokens = re.findall('\S+|\s+', text)
-    translate_log.debug('Tokenized: ' + '<' + '>, <'.join(tokens) + '>')
+    if translate_log.isEnabledFor(logging.DEBUG):
+        translate_log.debug('Tokenized: <%s>', '>, <'.join(tokens))
     return tokens
 
 
@@ -211,109 +338,277 @@ def translatable(token):
     """Return True or False depending on if the token needs translation."""
     # Unusual whitespace shouldn't be affected.
     if token.isspace() and token != ' ':
-        translate_log.debug('Token <' + token + '> is atypical whitespace.')
+        translate_log.debug('Token <%s> is atypical whitespace.', token)
         return False
 
     # Punctuation or unexpected characters should be left as is.
     if token.lower() == token.upper():
-        translate_log.debug('Token <' + token + '> has ambiguous case.')
+        translate_log.debug('Token <%s> has ambiguous case.', token)
         return False
 
     # Mentions shouldn't be translated.
     if token.startswith('@') or token.startswith('.@'):
-        translate_log.debug('Token <' + token + '> is a mention.')
+        translate_log.debug('Token <%s> is a mention.', token)
         return False
 
     # Hashtags shouldn't be translated.
     if token.startswith('#'):
-        translate_log.debug('Token <' + token + '> is a hashtag.')
+        translate_log.debug('Token <%s> is a hashtag.', token)
         return False
 
     # Links can't be translated.
     if token.startswith('http'):
-        translate_log.debug('Token <' + token + '> is a link.')
+        translate_log.debug('Token <%s> is a link.', token)
         return True  # Covid-19 Hack
         return False
 
     # Initials shouldn't be translated.
     if token.endswith('.') and len(token) == 2:
-        translate_log.debug('Token <' + token + '> is an initial.')
+        translate_log.debug('Token <%s> is an initial.', token)
         return False
 
     # For everything else, there's Mastercard.
-    translate_log.debug('Token <' + token + '> can be translated.')
+    translate_log.debug('Token <%s> can be translated.', token)
     return True
 
 
-def translate(text, vocab={}, limit=280):
+def translate(text, vocab={}, limit=280, engine=None):
     """Return a string of translated text, retaining original whitespace."""
     translate_log.info('Translating: ' + text)
     text = text.replace('http', ' http')  # Sometimes he forgets to use spaces.
 
+    # Use the vocab's own engine unless a specific one is supplied.
+    if engine is None:
+        engine = translate_engine(vocab)
+    engine.refresh()
+
+    # Reuse a translation remembered from an earlier run if there is one.
+    if engine.results:
+        translation = engine.results.get(text, engine.version, limit)
+    if engine.results and translation is not None:
+        translate_log.info('Translation remembered: ' + translation)
+        return translation
+
     # Tokenize the text and determine unique translations.
     tokens = tokenize(text)
-    unique = set(tokens)
-    new = {x: translate_token(x, vocab) for x in unique if translatable(x)}
-    new = {x: new[x] for x in new if new[x] != x}  # Keep only differences.
-    new_tokens = [new[x] if x in new else x for x in tokens]
-
-    # Enforce a limit on the translation length.
-    new_tokens = deduplicate_tokens(new_tokens, limit)
-    new_tokens = delete_tokens(new_tokens, limit, new)
+    changes = translate_unique(set(tokens), engine)
 
     # Report and return the translation made from joining the tokens.
-    translation = ''.join(new_tokens)
+    translation = translate_tokens(tokens, changes, limit)
     translate_log.info('Translation: ' + translation)
+
+    # Only remember it if its links were followed all the way, for next time.
+    links = [x for x in tokens if x.startswith('https://')]
+    if engine.results and all(engine.resolver.settled(x) for x in links):
+        engine.results.put(text, engine.version, translation, limit)
     return translation
 
 
-def translate_token(token, vocab={}):
+def translate_engine(vocab):
+    """Return the engine translating with a vocab, made on first use."""
+    kept = TRANSLATION_ENGINES.get(id(vocab))
+    if kept is not None and kept[0] is vocab:
+        return kept[1]
+    engine = TranslationEngine(vocab)
+    TRANSLATION_ENGINES.put(id(vocab), (vocab, engine))
+    return engine
+
+
+def translate_many(texts, vocab={}, limit=280, engine=None, chunk=1000):
+    """Yield translations for many texts, translating shared tokens once."""
+    if engine is None:
+        engine = translate_engine(vocab)
+    texts = iter(texts)
+
+    # Work through the texts a chunk at a time to keep memory flat.
+    while True:
+        batch = list(itertools.islice(texts, chunk))
+        if not batch:
+            break
+        translate_log.info('Translating batch of ' + str(len(batch)))
+        engine.refresh()
+
+        # Tokenize the whole chunk and translate its unique tokens once.
+        batch = [tokenize(x.replace('http', ' http')) for x in batch]
+        unique = set(itertools.chain.from_iterable(batch))
+        changes = translate_unique(unique, engine)
+
+        # Rebuild and length-fit each text from the shared translations.
+        for tokens in batch:
+            yield translate_tokens(tokens, changes, limit)
+
+
+def translate_part(part, vocab={}, counter=syllables):
+    """Translate a single segment of a token from vocab or by generation."""
+    lookup = part.lower()
+    if part.upper() == lookup:
+        return part
+    if lookup in vocab:
+        return case_mimic(vocab[lookup], part)
+
+    # Resort to deriving a translation based on syllables and plurality.
+    generated = syllables_repeat(part, counter=counter)
+    if part[-1] in ['s', 'z', 'y']:
+        generated = generated + part[-1]  # TODO: add 'ed'
+    return case_mimic(generated, part)
+
+
+def translate_token(token, vocab={}, engine=None):
     """Translate a token string based on a vocab dictionary or syllables."""
+    if engine is None:
+        engine = translate_engine(vocab)
+        engine.refresh()
     translated = False
     if token.upper() == token.lower():
         translated = token
 
     # Attempt to rewrite propaganda links.
     if not translated and token.startswith('https://'):
-        translated = translate_url(token)
+        translated = translate_url(token, engine.resolver)
 
     # Attempt to find the token in translation vocab.
     if not translated:
         lookup = token.lower()
     if not translated and lookup in vocab:
-        translate_log.debug('Translating <' + token + '> from vocab')
+        translate_log.debug('Translating <%s> from vocab', token)
         translated = case_mimic(vocab[lookup], token)
 
-    # Attempt to find subsets of the token in translation vocab.
+    # Attempt to find vocab words within the token, or generate the rest.
     if not translated:
-        parts = re.findall('[A-Za-z]{2,}|.', token)
-    if not translated and len(parts) > 1:
-        translate_log.debug('Translating <' + token + '> by splitting')
-        parts = [translate_token(x, vocab) for x in parts]
+        parts = segments(token, engine.trie)
+        method = 'splitting' if len(parts) > 1 else 'generation'
+        translate_log.debug('Translating <%s> by %s', token, method)
+        parts = [translate_part(x, vocab, engine.syllables) for x in parts]
         translated = ''.join(parts)
 
-    # Resort to deriving a translation based on syllables and plurality.
-    if not translated:
-        generated = syllables_repeat(token)
-    if not translated and token[-1] in ['s', 'z', 'y']:
-        generated = generated + token[-1]  # TODO: add 'ed'
-    if not translated:
-        translate_log.debug('Translating <' + token + '> by generation')
-        translated = case_mimic(generated, token)
-
     # Report and return the token's translation.
-    message = 'Token <' + token + '> translated to <' + translated + '>'
-    translate_log.debug(message)
+    message = 'Token <%s> translated to <%s>'
+    translate_log.debug(message, token, translated)
     return translated
 
 
-def translate_url(url):
-    """"""
-    translate_log.debug('Checking <' + url + '>  for redirects')
-    url = requests.get(url).url
-    translate_log.debug('URL resolved as ' + url)
+def translate_tokens(tokens, changes, limit=280):
+    """Return a string of tokens rebuilt from changes and fit to a limit."""
+    new = {x: changes[x] for x in set(tokens) if x in changes}
+    new_tokens = [new[x] if x in new else x for x in tokens]
+
+    # Enforce a limit on the translation length.
+    new_tokens = deduplicate_tokens(new_tokens, limit)
+    new_tokens = delete_tokens(new_tokens, limit, new)
+    return ''.join(new_tokens)
+
+
+def translate_unique(unique, engine):
+    """Return a dictionary of translations for tokens which need changing."""
+    engine.resolver.resolve_many(x for x in unique if x.startswith('https://'))
+    new = {x: engine.translate_token(x) for x in unique if translatable(x)}
+    return {x: new[x] for x in new if new[x] != x}  # Keep only differences.
+
+
+def translate_url(url, links=None):
+    """Rewrite a link to wherever it redirects, with a few special cases."""
+    if links is None:
+        links = resolver.URL_RESOLVER
+    translate_log.debug('Checking <%s>  for redirects', url)
+    url = links.resolve(url)
+    translate_log.debug('URL resolved as %s', url)
 
     if url.startswith('https://vote'):
         return 'https://joebiden.com/voter-guide/'  # lol
 
     return url
+
+
+def vocab_revision(vocab):
+    """Return a cheap summary of a vocab which changes when it's edited."""
+    if isinstance(vocab, collections.ChainMap):
+        return tuple(vocab_revision(x) for x in vocab.maps)
+    fingerprint = getattr(vocab, 'fingerprint', None)  # Compiled indexes.
+    if fingerprint:
+        return fingerprint
+
+    # Vocabs counting their own edits say so, others get invalidated.
+    return id(vocab), getattr(vocab, 'revision', None)
+
+
+def vocab_version(vocab):
+    """Return a digest of a vocab's contents which is stable between runs."""
+    fingerprint = getattr(vocab, 'fingerprint', None)  # Compiled indexes.
+    items = repr(fingerprint) if fingerprint else repr(sorted(vocab.items()))
+    return hashlib.sha1(items.encode('utf-8')).hexdigest()
+
+
+class TranslationEngine(object):
+    """
+    Memoizes token translations and syllable counts for a single vocab.
+    """
+
+    def __init__(self, vocab={}, size=8192, links=None, results=None):
+        """Compile syllable edge-cases and prepare empty memo caches."""
+        translate_log.debug('Translation engine initializing')
+        self.edgecases = syllables_compiled()
+        self.resolver = links if links else resolver.URL_RESOLVER
+        self.results = results
+        self.syllable_cache = utils.LRUCache(size)
+        self.token_cache = utils.LRUCache(size)
+        self.vocab = vocab
+
+    @property
+    def vocab(self):
+        """Return the vocab currently used for translations."""
+        return self._vocab
+
+    @vocab.setter
+    def vocab(self, vocab):
+        """Swap in a vocab, forgetting memoized translations."""
+        self._vocab = vocab
+        self.invalidate()
+
+    def invalidate(self):
+        """Forget memoized translations, as when the vocab's been edited."""
+        translate_log.debug('Translation engine caches invalidated')
+        self.revision = vocab_revision(self._vocab)
+        self.trie = segments_trie(self._vocab)
+        self.version = vocab_version(self._vocab)
+        self.syllable_cache.clear()
+        self.token_cache.clear()
+
+    def refresh(self):
+        """Forget memoized translations if the vocab's changed since."""
+        if vocab_revision(self._vocab) != self.revision:
+            self.invalidate()
+
+    def stats(self):
+        """Return hit/miss counters and sizes for the memo caches."""
+        return {
+            'syllables': self.syllable_cache.stats(),
+            'tokens': self.token_cache.stats(),
+        }
+
+    def syllables(self, token):
+        """Return a memoized syllable count for a token."""
+        lookup = token.lower()
+        if len(lookup) != len(token):
+            return syllables(token, self.edgecases)  # Unicode oddities.
+        result = self.syllable_cache.get(lookup)
+        if result is None:
+            result = syllables(token, self.edgecases)
+            self.syllable_cache.put(lookup, result)
+        return result
+
+    def translate(self, text, limit=280):
+        """Return a string of translated text using the engine's vocab."""
+        return translate(text, self.vocab, limit, self)
+
+    def translate_token(self, token):
+        """Return a memoized translation of a token."""
+        if token.startswith('https://'):
+            return translate_token(token, self.vocab, self)  # Don't pin URLs.
+        result = self.token_cache.get(token)
+        if result is None:
+            result = translate_token(token, self.vocab, self)
+            self.token_cache.put(token, result)
+        return result
+
+
+TRANSLATION_ENGINES = utils.LRUCache(ENGINES_KEPT)
@@ -1,17 +1,56 @@
 """
 """
+import collections.abc
+import functools
+import hashlib
 import html
 import json
 import logging
 import random
+import re
+import requests
+import sys
+import threading
 import time
 import tweepy
-from martiandtrump import utils
+from martiandtrump import limiter, scheduler, utils
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 
 SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
 twitter_log = logging.getLogger(SCRIPT_NAME + '.twitter')
 
+# Decode payloads with orjson when it's installed, it's several times faster.
+JSON_LOADS = orjson.loads if orjson else json.loads
+
+# Clients already built, by credential fingerprint, shared process-wide.
+CLIENTS = {}
+CLIENTS_LOCK = threading.Lock()
+CLIENT_KEYS = ('consumer_key', 'consumer_secret', 'access_key',
+               'access_secret')
+LIMITS_KEYS = ('posts', 'window', 'backoff')
+
+# Seconds before retrying a post that couldn't reach the API.
+RETRY_DELAY = 60
+
+# API error code for a tweet that doesn't exist, or no longer does.
+TWEET_MISSING = 144
+
+# Fields every parsed event has, in the order they're listed.
+EVENT_KEYS = ('body', 'body_id', 'type', 'user', 'user_id')
+
+# Raw keys marking each kind of event, only ever unescaped outside strings.
+PARSE_MARKERS = {
+    'delete': '"delete":',
+    'direct_message': '"direct_message":',
+    'event': '"event":',
+    'retweet': '"retweeted_status":',
+}
+
 
 def authenticate(consumer_key, consumer_secret, access_key, access_secret):
     """Return an authenticated OAuth handler for interacting with Twitter."""
@@ -21,10 +60,69 @@ def authenticate(consumer_key, consumer_secret, access_key, access_secret):
     return auth
 
 
+def client(credentials, limits={}):
+    """Return the shared API client for a credentials dict or OAuth handler."""
+    if isinstance(credentials, tweepy.API):
+        return credentials
+    key = client_fingerprint(credentials)
+    with CLIENTS_LOCK:
+        if key not in CLIENTS:
+            auth = credentials
+            if isinstance(credentials, dict):
+                auth = authenticate(**credentials)
+            limits = {k: limits[k] for k in LIMITS_KEYS if limits.get(k)}
+            CLIENTS[key] = TwitterClient(auth, limiter.RateLimiter(**limits))
+            twitter_log.debug('Twitter client created for ' + key[:12])
+        return CLIENTS[key]
+
+
+def client_fingerprint(credentials):
+    """Return a digest identifying a set of credentials, without storing it."""
+    if isinstance(credentials, tweepy.auth.OAuthHandler):
+        credentials = {
+            'access_key': credentials.access_token,
+            'access_secret': credentials.access_token_secret,
+            'consumer_key': credentials.consumer_key,
+            'consumer_secret': credentials.consumer_secret,
+        }
+    values = [credentials.get(x) or '' for x in CLIENT_KEYS]
+    values = [x.decode('utf-8') if isinstance(x, bytes) else str(x)
+              for x in values]  # Tweepy keeps consumer keys as bytes.
+    return hashlib.sha256('\0'.join(values).encode('utf-8')).hexdigest()
+
+
+def delete(connection, tweet_id):
+    """Use a twitter connection to delete one of its own tweets."""
+    if isinstance(connection, (dict, tweepy.auth.OAuthHandler)):
+        connection = client(connection)
+
+    # Attempt to delete the given tweet ID and return True on success.
+    try:
+        connection.destroy_status(tweet_id)
+        twitter_log.info('Tweet ID ' + str(tweet_id) + ' deleted')
+        return True
+
+    # Ask to be retried if the API was busy or unreachable.
+    except tweepy.TweepError as error:
+        retry = tweet_retry(connection, error)
+        if retry is not None:
+            twitter_log.warn('Deleting tweet ID ' + str(tweet_id) +
+                             ' failed, retrying: ' + str(error))
+            raise retry
+
+        # A tweet that's already gone needs no more deleting.
+        if error.api_code == TWEET_MISSING:
+            twitter_log.info('Tweet ID ' + str(tweet_id) + ' already gone')
+            return True
+        twitter_log.error('Deleting tweet ID ' + str(tweet_id) +
+                          ' failed: ' + str(error))
+        return False
+
+
 def parse(payload, only=[], exclude=[]):
     """Attempt to parse a twitter event payload based on known structures."""
     payload = payload.strip()
-    payload = json.loads(payload)
+    payload = JSON_LOADS(payload)
 
     # Tests to perform on the payload, and corresponding parser functions.
     tests = [
@@ -49,8 +147,8 @@ def parse(payload, only=[], exclude=[]):
         log_only = only and user_id in only
         log_excluded = not only and user_id not in exclude
         if log_only or log_excluded:
-            twitter_log.debug('Parsing Twitter event: ' + str(payload))
-            twitter_log.debug('Parsed Twitter event: ' + str(parsed))
+            twitter_log.debug('Parsing Twitter event: %s', payload)
+            twitter_log.debug('Parsed Twitter event: %s', parsed)
         return parsed
 
     # Log any parsing failures.
@@ -60,79 +158,106 @@ def parse(payload, only=[], exclude=[]):
 
 def parse_body(payload):
     """Simplify getting the full, unabridged text of a given event payload."""
-    fulltext = payload.get('extended_tweet', {}).get('full_text')
-    body = fulltext if fulltext else payload['text']
-    return html.unescape(body)
+    return html.unescape(parse_text(payload))
+
+
+def parse_candidate(payload, user_ids, skip=['delete', 'retweet']):
+    """Cheaply check whether a raw payload might be worth parsing in full."""
+    raw = isinstance(payload, bytes)
+    user_ids, markers = parse_markers(tuple(user_ids), tuple(skip), raw)
+
+    # Events about a user always carry their ID somewhere in the payload.
+    if not user_ids.search(payload):
+        return False
+    for marker in markers:
+        if marker in payload:
+            return False
+    return True
 
 
 def parse_delete(payload):
     """Parse the event payload of a Twitter status deletion."""
-    return {
-        'body': None,
-        'body_id': payload['delete']['status']['id'],
-        'type': 'delete',
-        'user': None,
-        'user_id': payload['delete']['status']['user_id'],
-    }
+    return TwitterEvent(
+        body_id=payload['delete']['status']['id'],
+        type='delete',
+        user_id=payload['delete']['status']['user_id'],
+    )
 
 
 def parse_direct_message(payload):
     """Parse the event payload of a Twitter direct message."""
-    return {
-        'body': payload['direct_message']['text'],
-        'body_id': payload['direct_message']['id'],
-        'type': 'direct_message',
-        'user': payload['direct_message']['sender_screen_name'],
-        'user_id': payload['direct_message']['sender_id'],
-    }
+    return TwitterEvent(
+        body=payload['direct_message']['text'],
+        body_id=payload['direct_message']['id'],
+        type='direct_message',
+        user=payload['direct_message']['sender_screen_name'],
+        user_id=payload['direct_message']['sender_id'],
+    )
 
 
 def parse_event(payload):
     """Parse the event payload of a self-describing Twitter event."""
-    return {
-        'body': payload['target_object']['text'],
-        'body_id': payload['target_object']['id'],
-        'type': payload.get('event'),
-        'user': payload['source']['screen_name'],
-        'user_id': payload['source']['id'],
-    }
+    kind = payload.get('event')
+    return TwitterEvent(
+        body=payload['target_object']['text'],
+        body_id=payload['target_object']['id'],
+        type=sys.intern(kind) if isinstance(kind, str) else kind,
+        user=payload['source']['screen_name'],
+        user_id=payload['source']['id'],
+    )
 
 
 def parse_friends(payload):
     """Parse the werid friends list that happens on users timelines."""
-    return {
-        'body': None,
-        'body_id': None,
-        'type': 'friends',
-        'user': None,
-        'user_id': None,
-    }
+    return TwitterEvent(type='friends')
+
+
+@functools.lru_cache(maxsize=64)
+def parse_markers(user_ids, skip, raw=False):
+    """Return what parse_candidate looks for in payloads, user IDs as one."""
+    user_ids = '|'.join(str(x) for x in sorted(user_ids, key=str))
+    markers = tuple(PARSE_MARKERS[x] for x in skip)
+    if raw:
+        user_ids = user_ids.encode('ascii')
+        markers = tuple(x.encode('ascii') for x in markers)
+    return re.compile(user_ids), markers
 
 
 def parse_retweet(payload):
     """Parse the event payload of a Twitter retweet."""
-    return {
-        'body': parse_body(payload),
-        'body_id': payload['id'],
-        'type': 'retweet',
-        'user': payload['user']['screen_name'],
-        'user_id': payload['user']['id'],
-    }
+    return TwitterEvent(
+        body=parse_text(payload),
+        body_id=payload['id'],
+        type='retweet',
+        user=payload['user']['screen_name'],
+        user_id=payload['user']['id'],
+        escaped=True,
+    )
+
+
+def parse_text(payload):
+    """Return the full text of an event payload, still HTML escaped."""
+    fulltext = payload.get('extended_tweet', {}).get('full_text')
+    return fulltext if fulltext else payload['text']
 
 
 def parse_tweet(payload):
     """Parse the event payload of a regular Twitter tweet."""
-    return {
-        'body': parse_body(payload),
-        'body_id': payload['id'],
-        'type': 'tweet',
-        'user': payload['user']['screen_name'],
-        'user_id': payload['user']['id'],
-    }
+    return TwitterEvent(
+        body=parse_text(payload),
+        body_id=payload['id'],
+        type='tweet',
+        user=payload['user']['screen_name'],
+        user_id=payload['user']['id'],
+        escaped=True,
+    )
 
 
 def retweet(connection, tweet_id):
     """Use a twitter connection to retweet a supplied tweet ID."""
+    if isinstance(connection, (dict, tweepy.auth.OAuthHandler)):
+        connection = client(connection)
+
     # Attempt to retweet the given tweet ID and return True on success.
     try:
         connection.retweet(tweet_id)
@@ -145,12 +270,11 @@ def retweet(connection, tweet_id):
         return False
 
 
-def tweet(connection, body, reply_to=None, delay=0, delay_variance=None):
+def tweet(connection, body, reply_to=None, delay=0, delay_variance=None,
+          key=None, posts=None, posted=None):
     """Use a twitter connection to post a tweet with optional reply/delay."""
-    if isinstance(connection, dict):
-        connection = authenticate(**connection)
-    if isinstance(connection, tweepy.auth.OAuthHandler):
-        connection = tweepy.API(connection)
+    if isinstance(connection, (dict, tweepy.auth.OAuthHandler)):
+        connection = client(connection)
     body = random.choice(body) if isinstance(body, list) else str(body)
 
     # Handle any requested delay in posting.
@@ -160,18 +284,161 @@ def tweet(connection, body, reply_to=None, delay=0, delay_variance=None):
         delay_min = delay - delay_variance
         delay_max = delay + delay_variance
         delay = random.randint(delay_min, delay_max)
-    if delay and delay > 0:
+
+    # Leave delayed tweets to a scheduler, cancellable by key until posted.
+    posts = scheduler.POST_SCHEDULER if posts is None else posts
+    if delay and int(delay) > 0:
         twitter_log.debug('Tweet delayed by ' + str(delay))
-        time.sleep(delay)
+        return posts.schedule(int(delay), tweet_post, connection, body,
+                              reply_to, key, posted, key=key)
+    post = scheduler.ScheduledPost(time.monotonic(), tweet_post,
+                                   (connection, body, reply_to, key, posted),
+                                   key, posts)
+    post.fire()
+    return post
+
 
+def tweet_post(connection, body, reply_to=None, key=None, posted=None):
+    """Post a tweet straight away, returning True on success."""
     # Attempt to tweet the given payload and return True on success.
     try:
-        connection.update_status(status=body, in_reply_to_status_id=reply_to)
+        status = connection.update_status(status=body,
+                                          in_reply_to_status_id=reply_to)
         twitter_log.info('Tweet posted successfully: ' + body)
+
+        # Remember what it translated, so deleting that can delete this.
+        if posted is not None and key is not None:
+            posted.put(key, status.id)
         return True
 
-    # In the event an error occurred, log it and return False.
+    # Ask to be retried once the rate limit allows, or the API's reachable.
     except tweepy.TweepError as error:
+        retry = tweet_retry(connection, error)
+        if retry is not None:
+            twitter_log.warn('Tweet posting failed, retrying: ' + str(error))
+            raise retry
         twitter_log.error('Tweet posting failed: ' + str(error))
         return False
 
+
+def tweet_retry(connection, error):
+    """Return a Retry for an API error worth trying again, or None."""
+    rate = getattr(connection, 'limiter', None)
+    if isinstance(error, tweepy.RateLimitError):
+        return scheduler.Retry(rate.delay(), str(error)) if rate else None
+    if error.response is None:
+        delay = rate.backoff if rate else RETRY_DELAY
+        return scheduler.Retry(delay, str(error))
+    return None
+
+
+class TwitterClient(tweepy.API):
+    """
+    A tweepy API client that posts over one kept-alive HTTP session.
+    """
+
+    def __init__(self, auth, rate=None, scheme='https', **kwargs):
+        """Prepare the API client along with its pooled session."""
+        tweepy.API.__init__(self, auth, **kwargs)
+        self.limiter = rate if rate else limiter.RateLimiter()
+        self.scheme = scheme
+        self.session = requests.Session()
+
+    def close(self):
+        """Close the client's pooled connections."""
+        self.session.close()
+
+    def destroy_status(self, id):
+        """Delete a tweet, keeping the connection open afterwards."""
+        return self.post('/statuses/destroy/' + str(id) + '.json')
+
+    def post(self, path, **params):
+        """POST to an API path, returning the status it responds with."""
+        url = self.scheme + '://' + self.host + self.api_root + path
+        params = {k: v for k, v in params.items() if v is not None}
+        wait = self.limiter.acquire()
+        if wait > 0:
+            message = 'Rate limit reached, {:.1f}s until the next post'
+            raise tweepy.RateLimitError(message.format(wait))
+        try:
+            response = self.session.post(url, data=params,
+                                         auth=self.auth.apply_auth(),
+                                         timeout=self.timeout)
+        except requests.RequestException as error:
+            raise tweepy.TweepError('Failed to send request: ' + str(error))
+        self.last_response = response
+
+        # Keep the limiter in step with what the API says about limits.
+        self.limiter.update(response.headers)
+        if response.status_code in [420, 429]:
+            self.limiter.throttle(response.headers)
+        elif response.status_code < 400:
+            self.limiter.succeed()
+
+        # Raise errors the way tweepy does, so callers see no difference.
+        if not 200 <= response.status_code < 300:
+            try:
+                message, code = self.parser.parse_error(response.text)
+            except Exception:
+                message = 'Twitter error response: status code = ' + \
+                    str(response.status_code)
+                code = None
+            if tweepy.error.is_rate_limit_error_message(message) or \
+                    response.status_code in [420, 429]:
+                raise tweepy.RateLimitError(message, response)
+            raise tweepy.TweepError(message, response, api_code=code)
+        return tweepy.Status.parse(self, response.json())
+
+    def retweet(self, id):
+        """Retweet a tweet, keeping the connection open afterwards."""
+        return self.post('/statuses/retweet/' + str(id) + '.json')
+
+    def update_status(self, status=None, in_reply_to_status_id=None,
+                      **params):
+        """Post a tweet, keeping the connection open afterwards."""
+        return self.post('/statuses/update.json', status=status,
+                         in_reply_to_status_id=in_reply_to_status_id,
+                         **params)
+
+
+class TwitterEvent(collections.abc.Mapping):
+    """
+    A parsed Twitter event, readable by attribute or like the dict it was.
+    """
+    __slots__ = ('_body', '_escaped', 'body_id', 'type', 'user', 'user_id')
+
+    def __init__(self, body=None, body_id=None, type=None, user=None,
+                 user_id=None, escaped=False):
+        """Store an event's fields, leaving escaped bodies until read."""
+        self._body = body
+        self._escaped = escaped
+        self.body_id = body_id
+        self.type = type
+        self.user = user
+        self.user_id = user_id
+
+    def __getitem__(self, key):
+        """Return a field by name, as parsed events used to be dicts."""
+        if key not in EVENT_KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __iter__(self):
+        """Iterate over the names of the event's fields."""
+        return iter(EVENT_KEYS)
+
+    def __len__(self):
+        """Return the number of fields in the event."""
+        return len(EVENT_KEYS)
+
+    def __repr__(self):
+        """Return the event's fields, for logging."""
+        return 'TwitterEvent(' + str(dict(self)) + ')'
+
+    @property
+    def body(self):
+        """Return the event's text, unescaping it the first time it's read."""
+        if self._escaped:
+            self._body = html.unescape(self._body)
+            self._escaped = False
+        return self._body
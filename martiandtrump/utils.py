@@ -1,18 +1,23 @@
 """
 """
+import collections
 import datetime
 import io
 import logging
 import __main__ as main
 import os
+import sys
+import threading
 import time
 
 
 # This has to come first so logging works properly.
 def script_meta():
     """Return the path and name of the main python script."""
-    path = os.path.abspath(os.path.dirname(main.__file__))
-    name = os.path.basename(main.__file__).rsplit('.', 1)[0]
+    # Pool processes started from a server run the script as argv[0].
+    script = getattr(main, '__file__', None) or sys.argv[0]
+    path = os.path.abspath(os.path.dirname(script))
+    name = os.path.basename(script).rsplit('.', 1)[0]
     return path, name
 
 
@@ -31,12 +36,31 @@ def log_cleanup(log_path, stream, logger=None):
     return os.path.exists(log_path)
 
 
-def log_setup(name=__name__, handlers=[], logger=None):
+def log_level(name, default=logging.INFO):
+    """Return the number of a named logging level, or a default if unknown."""
+    if isinstance(name, int):
+        return name
+    level = logging.getLevelName(str(name).upper())
+    return level if isinstance(level, int) else default
+
+
+def log_setup(name=__name__, handlers=[], logger=None, level=None):
     """Return a logger object and optional stream with a bunch of handlers."""
     stream = False
     if logger is None:
         logger = logging.getLogger(name)
-        logger.setLevel(logging.DEBUG)
+
+    # Unknown levels, like a typo in the config, log at INFO instead.
+    named = [level] + [x for _, x, _ in handlers]
+    unknown = [x for x in named if x and log_level(x, None) is None]
+
+    # Unwanted messages cost nothing if the logger itself discards them.
+    levels = [log_level(x) for _, x, _ in handlers if x]
+    if level:
+        level = log_level(level)
+    elif levels:
+        level = min(levels)
+    logger.setLevel(level if level else logging.DEBUG)
 
     # Loop over triplets describing required handlers.
     for handle, level, formatting in handlers:
@@ -53,8 +77,7 @@ def log_setup(name=__name__, handlers=[], logger=None):
 
         # Prepare log level filtering.
         if level:
-            level = logging.getLevelName(level)
-            handler.setLevel(level)
+            handler.setLevel(log_level(level))
 
         # Prepare optional log formatting.
         if formatting:
@@ -63,6 +86,8 @@ def log_setup(name=__name__, handlers=[], logger=None):
 
         # Add handler to the logger.
         logger.addHandler(handler)
+    for level in unknown:
+        logger.warn('Unknown log level ' + str(level) + ', using INFO')
 
     # Return the configured logger, and a single optional log stream.
     return (logger, stream)
@@ -132,3 +157,75 @@ def text_fromstamp(stamp):
     dt = datetime.datetime.fromtimestamp(int(stamp))
     since = datetime.datetime.utcnow() - dt
     return text_time(stamp=stamp), text_since(since.total_seconds())
+
+
+class LRUCache(object):
+    """
+    A bounded mapping which forgets its least recently used items first.
+    """
+
+    def __init__(self, size=4096, ttl=None):
+        """Prepare an empty cache holding at most size items for ttl secs."""
+        self.items = collections.OrderedDict()
+        self.lock = threading.Lock()
+        self.size = size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        """Check for a key without affecting recency or counters."""
+        with self.lock:
+            return key in self.items and not self.expired(key)
+
+    def __len__(self):
+        """Return the number of items currently cached."""
+        return len(self.items)
+
+    def clear(self):
+        """Forget every cached item, leaving the counters untouched."""
+        with self.lock:
+            self.items.clear()
+
+    def expired(self, key):
+        """Return True if a cached item has outlived the cache's ttl."""
+        expires = self.items[key][1]
+        return expires is not None and expires < time.monotonic()
+
+    def get(self, key, default=None):
+        """Return a cached value and mark it recently used, or the default."""
+        with self.lock:
+            if key not in self.items or self.expired(key):
+                self.items.pop(key, None)
+                self.misses += 1
+                return default
+            self.items.move_to_end(key)
+            self.hits += 1
+            return self.items[key][0]
+
+    def peek(self, key, default=None):
+        """Return a cached value without affecting recency or counters."""
+        with self.lock:
+            if key not in self.items or self.expired(key):
+                return default
+            return self.items[key][0]
+
+    def put(self, key, value, ttl=None):
+        """Cache a value, evicting the least recently used items if full."""
+        ttl = ttl if ttl else self.ttl
+        expires = time.monotonic() + ttl if ttl else None
+        with self.lock:
+            self.items[key] = (value, expires)
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+        return value
+
+    def stats(self):
+        """Return a dictionary of the cache's size and hit/miss counters."""
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'size': len(self.items),
+            'limit': self.size,
+        }
@@ -0,0 +1,224 @@
+"""
+"""
+import collections.abc
+import configparser
+import logging
+import mmap
+import os
+import struct
+from martiandtrump import config, utils
+
+
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+vocab_log = logging.getLogger(SCRIPT_NAME + '.vocabulary')
+
+# Index layout: a header, key and value offset tables, then the UTF-8 blobs.
+INDEX_HEADER = struct.Struct('<4sHHqqI')
+INDEX_MAGIC = b'MDTV'
+INDEX_VERSION = 1
+
+
+def vocab_compile(config_path, index_path):
+    """Compile the vocab section of a config file into a binary index."""
+    vocab_log.info('Compiling vocab index: ' + index_path)
+    parser = configparser.ConfigParser()
+    with open(config_path) as handle:
+        parser.read_file(handle)
+    vocab = dict(parser['vocab']) if parser.has_section('vocab') else {}
+
+    # Sort the encoded keys so lookups can binary search them.
+    entries = [(k.encode('utf-8'), v.encode('utf-8')) for k, v in vocab.items()]
+    entries.sort()
+    keys = b''.join(k for k, _ in entries)
+    values = b''.join(v for _, v in entries)
+    key_offsets = vocab_offsets([k for k, _ in entries])
+    value_offsets = vocab_offsets([v for _, v in entries])
+
+    # Stamp the index with the config file it was compiled from.
+    source = os.stat(config_path)
+    header = INDEX_HEADER.pack(INDEX_MAGIC, INDEX_VERSION, 0,
+                               source.st_mtime_ns, source.st_size,
+                               len(entries))
+    offsets = struct.pack('<%dI' % len(key_offsets), *key_offsets)
+    offsets += struct.pack('<%dI' % len(value_offsets), *value_offsets)
+
+    # Write to a temporary file and rename it so readers never see half.
+    temporary = index_path + '.' + str(os.getpid())
+    with open(temporary, 'wb') as handle:
+        handle.write(header + offsets + keys + values)
+    os.replace(temporary, index_path)
+    vocab_log.info('Vocab index compiled with ' + str(len(entries)) + ' words')
+    return index_path
+
+
+def vocab_index_path(config_path):
+    """Return the path of the compiled index for a config file's vocab."""
+    name = os.path.basename(config_path).rsplit('.', 1)[0]
+    return os.path.join(SCRIPT_DIR, 'cache', name + '-vocab.index')
+
+
+def vocab_load(config_path, index_path=None):
+    """Return an up to date vocab index, or a plain dict if that fails."""
+    if index_path is None:
+        index_path = vocab_index_path(config_path)
+
+    # Try to compile the index if it's missing or outdated, then open it.
+    try:
+        if vocab_stale(config_path, index_path):
+            directory = os.path.dirname(index_path)
+            os.makedirs(directory, exist_ok=True)
+            vocab_compile(config_path, index_path)
+        return VocabIndex(index_path)
+
+    # Fall back to parsing the config file if the index can't be used.
+    except (OSError, ValueError, configparser.Error) as e:
+        vocab_log.error('Vocab index unusable: ' + str(e))
+        config_dict = config.config_load(config_path)
+        return Vocab(config_dict['vocab'] if 'vocab' in config_dict else {})
+
+
+def vocab_offsets(blobs):
+    """Return the running offsets bounding each of a list of byte strings."""
+    offsets = [0]
+    for blob in blobs:
+        offsets.append(offsets[-1] + len(blob))
+    return offsets
+
+
+def vocab_stale(config_path, index_path):
+    """Return True if an index is missing or older than its config file."""
+    try:
+        with open(index_path, 'rb') as handle:
+            header = handle.read(INDEX_HEADER.size)
+        magic, version, _, mtime, size, _ = INDEX_HEADER.unpack(header)
+    except (OSError, struct.error):
+        return True
+    source = os.stat(config_path)
+    current = (INDEX_MAGIC, INDEX_VERSION, source.st_mtime_ns, source.st_size)
+    return (magic, version, mtime, size) != current
+
+
+class VocabIndex(collections.abc.Mapping):
+    """
+    A read-only vocab mapping served from a memory-mapped compiled index.
+    """
+
+    def __init__(self, index_path):
+        """Map the index file into memory and locate its tables."""
+        vocab_log.debug('Vocab index opening: ' + index_path)
+        self.path = index_path
+        with open(index_path, 'rb') as handle:
+            self.data = mmap.mmap(handle.fileno(), 0, access=mmap.ACCESS_READ)
+        header = INDEX_HEADER.unpack_from(self.data)
+        magic, version, _, mtime, size, self.count = header
+        if (magic, version) != (INDEX_MAGIC, INDEX_VERSION):
+            raise ValueError('Not a vocab index: ' + index_path)
+        self.fingerprint = (index_path, mtime, size)
+
+        # Offset tables and blobs are sliced from the map, not copied.
+        view = memoryview(self.data)
+        start = INDEX_HEADER.size
+        table = 4 * (self.count + 1)
+        self.key_offsets = view[start:start + table].cast('I')
+        self.value_offsets = view[start + table:start + 2 * table].cast('I')
+        self.keys = start + 2 * table
+        self.values = self.keys + self.key_offsets[self.count]
+
+    def __getitem__(self, key):
+        """Return the translation for a word, or raise KeyError."""
+        idx = self.find(key)
+        if idx is None:
+            raise KeyError(key)
+        start = self.values + self.value_offsets[idx]
+        finish = self.values + self.value_offsets[idx + 1]
+        return self.data[start:finish].decode('utf-8')
+
+    def __contains__(self, key):
+        """Return True if the word has a translation."""
+        return self.find(key) is not None
+
+    def __iter__(self):
+        """Yield every word in the index in sorted order."""
+        for idx in range(self.count):
+            yield self.key(idx).decode('utf-8')
+
+    def __len__(self):
+        """Return the number of words in the index."""
+        return self.count
+
+    def __reduce__(self):
+        """Pickle just the path, so other processes map the same pages."""
+        return VocabIndex, (self.path,)
+
+    def find(self, key):
+        """Return the position of a word by binary search, or None."""
+        if not isinstance(key, str):
+            return None
+        target = key.encode('utf-8')
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            if self.key(middle) < target:
+                low = middle + 1
+            else:
+                high = middle
+        if low < self.count and self.key(low) == target:
+            return low
+        return None
+
+    def key(self, idx):
+        """Return the encoded word stored at a position."""
+        start = self.keys + self.key_offsets[idx]
+        finish = self.keys + self.key_offsets[idx + 1]
+        return self.data[start:finish]
+
+
+class Vocab(dict):
+    """
+    A vocab dict counting its edits, so translation engines notice them.
+    """
+
+    def __init__(self, *args, **kwargs):
+        """Fill the vocab, counting from no edits."""
+        dict.__init__(self, *args, **kwargs)
+        self.revision = 0
+
+    def __delitem__(self, key):
+        """Remove a word."""
+        dict.__delitem__(self, key)
+        self.revision += 1
+
+    def __ior__(self, other):
+        """Add or replace words in place."""
+        self.update(other)
+        return self
+
+    def __setitem__(self, key, value):
+        """Add or replace a word."""
+        dict.__setitem__(self, key, value)
+        self.revision += 1
+
+    def clear(self):
+        """Remove every word."""
+        dict.clear(self)
+        self.revision += 1
+
+    def pop(self, *args):
+        """Remove a word, returning its translation."""
+        self.revision += 1
+        return dict.pop(self, *args)
+
+    def popitem(self):
+        """Remove the last word added, returning it and its translation."""
+        self.revision += 1
+        return dict.popitem(self)
+
+    def setdefault(self, key, default=None):
+        """Add a word unless it's there already, returning its translation."""
+        self.revision += 1
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        """Add or replace many words."""
+        dict.update(self, *args, **kwargs)
+        self.revision += 1
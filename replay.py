@@ -0,0 +1,50 @@
+"""
+"""
+import argparse
+import os
+import tempfile
+from martiandtrump import config, replay, streamer, utils, vocabulary
+
+
+CONFIG_FILE = 'config.ini'
+CONSOLE_FORMAT = '%(levelname)s %(message)s'
+SCRIPT_DIR, SCRIPT_NAME = utils.script_meta()
+
+
+if __name__ == '__main__':
+
+    # Read the options for this replay.
+    parser = argparse.ArgumentParser(prog=SCRIPT_NAME)
+    parser.add_argument('events',
+                        help='file of stream events recorded by the bot')
+    parser.add_argument('--speed', type=float, default=1.0,
+                        help='multiple of real time, 0 replays flat out')
+    parser.add_argument('--latency', type=float, default=0.0,
+                        help='seconds each fake post takes')
+    parser.add_argument('--links', type=float, default=0.0,
+                        help='seconds following each fake link takes')
+    options = parser.parse_args()
+
+    # Only report problems, so logging doesn't distort the timings.
+    handlers = [('console', 'ERROR', CONSOLE_FORMAT)]
+    log, _ = utils.log_setup(SCRIPT_NAME, handlers)
+
+    # Replay through a translator set up as the bot's, posting nowhere.
+    config_path = os.path.join(SCRIPT_DIR, CONFIG_FILE)
+    config_dict = config.config_load(config_path, exclude=['vocab'])
+    stages = dict(config_dict['pipeline']) if 'pipeline' in config_dict \
+        else {}
+    stages['record'] = None
+    vocab = vocabulary.vocab_load(config_path)
+    account = replay.FakeClient(options.latency)
+    links = replay.FakeResolver(options.links)
+    with tempfile.TemporaryDirectory() as scratch:
+        stages['outbox'] = os.path.join(scratch, 'outbox.log')
+        stages['seen'] = os.path.join(scratch, 'seen.index')
+        stages['posted'] = os.path.join(scratch, 'posted.map')
+        listener = streamer.StreamTranslator(
+            account, config_dict['source']['id'], vocab, None, stages,
+            links=links)
+        report = replay.replay_run(options.events, listener, options.speed)
+    links.close()
+    print(replay.replay_report(report))
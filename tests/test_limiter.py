@@ -0,0 +1,128 @@
+"""
+"""
+import http.server
+import json
+import threading
+import time
+import unittest
+from martiandtrump import limiter, scheduler, twitter
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers like the Twitter API, rate limiting while told to.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        """Post a tweet, or answer with a rate limit response."""
+        length = int(self.headers.get('content-length', 0))
+        self.rfile.read(length)
+        self.server.requests.append(time.monotonic())
+        headers = {}
+        if self.server.limited:
+            status, headers = self.server.limited.pop(0)
+            body = {'errors': [{'code': 88, 'message': 'Rate limit exceeded'}]}
+        else:
+            status = 200
+            body = {'id': len(self.server.requests), 'text': 'posted'}
+        body = json.dumps(body).encode('utf-8')
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        """Keep quiet."""
+
+
+class RateLimitTest(unittest.TestCase):
+    """
+    Posts through a rate limited client to a local stand-in API.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Start the stand-in API on a free port."""
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     StandInHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the stand-in API."""
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        """Start each test with no requests and nothing rate limited."""
+        self.server.limited = []
+        self.server.requests = []
+        self.posts = None
+
+    def tearDown(self):
+        """Close the test's scheduler and client."""
+        if self.posts is not None:
+            self.posts.close()
+        self.client.close()
+
+    def connect(self, posts=300, window=10800, backoff=0.2, retries=100):
+        """Return a client for the stand-in API, and a scheduler for it."""
+        auth = twitter.authenticate('key', 'secret', 'token', 'secret')
+        rate = limiter.RateLimiter(posts, window, backoff)
+        self.client = twitter.TwitterClient(auth, rate, scheme='http')
+        self.client.host = '127.0.0.1:' + str(self.server.server_port)
+        self.posts = scheduler.PostScheduler(retries, attempts=5)
+        return self.client, self.posts
+
+    def test_backoff_doubles(self):
+        """Rate limits without a time to come back double the backoff."""
+        client, posts = self.connect(backoff=0.2)
+        self.server.limited = [(420, {}), (429, {}), (429, {})]
+        post = twitter.tweet(client, 'backing off', posts=posts)
+        self.assertTrue(post.wait(10))
+        self.assertEqual(post.attempts, 4)
+        self.assertEqual(client.limiter.failures, 0)
+        requests = self.server.requests
+        gaps = [y - x for x, y in zip(requests, requests[1:])]
+        for gap, backoff in zip(gaps, [0.2, 0.4, 0.8]):
+            self.assertGreaterEqual(gap, backoff * 0.9)
+            self.assertLess(gap, backoff + 0.5)
+
+    def test_retry_after(self):
+        """A rate limit's retry-after header is waited out in full."""
+        client, posts = self.connect(backoff=0.1)
+        self.server.limited = [(429, {'retry-after': '1'})]
+        began = time.monotonic()
+        post = twitter.tweet(client, 'waiting', posts=posts)
+        self.assertIsNone(post.result)
+        self.assertTrue(post.wait(10))
+        self.assertGreaterEqual(time.monotonic() - began, 0.9)
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_retry_queue_overflow(self):
+        """Posts beyond a full bucket and retry queue are given up on."""
+        client, posts = self.connect(posts=2, window=60, retries=3)
+        burst = [twitter.tweet(client, 'burst ' + str(x), posts=posts)
+                 for x in range(8)]
+        self.assertEqual([x.result for x in burst[:2]], [True, True])
+        self.assertEqual([x.done() for x in burst[2:5]], [False] * 3)
+        self.assertEqual(len(posts), 3)
+        for post in burst[5:]:
+            self.assertTrue(post.given_up)
+            self.assertFalse(post.result)
+        self.assertEqual(len(self.server.requests), 2)
+
+        # Closing leaves the waiting retries given up, for the outbox.
+        posts.close()
+        self.assertTrue(all(x.given_up for x in burst[2:5]))
+        self.posts = None
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,51 @@
+"""
+"""
+import random
+import string
+import unittest
+from martiandtrump import numeric, translator
+
+
+# Random words compared, and characters they're made of.
+WORDS = 50000
+WORD_CHARACTERS = string.ascii_letters + "aeiouyaeiouyeee'- "
+
+
+def numeric_words(count, seed=1):
+    """Return a reproducible list of made-up words and awkward tokens."""
+    rng = random.Random(seed)
+    words = ['', ' ', '\t', '\n', 'a', 'e', "'", 'ee', 'élan', 'Ünïcode',
+             'x' * (numeric.SYLLABLES_WIDTH + 1)]
+    words.extend(x for x, _ in translator.syllables_edgecases())
+    while len(words) < count:
+        size = rng.randint(1, 14)
+        words.append(''.join(rng.choice(WORD_CHARACTERS)
+                             for _ in range(size)))
+    return words
+
+
+@unittest.skipIf(numeric.numpy is None, 'NumPy not installed')
+class SyllablesArrayTest(unittest.TestCase):
+    """
+    Checks batch syllable counts against counting one token at a time.
+    """
+
+    def test_empty(self):
+        """Empty tokens have no syllables, even when they're all there is."""
+        self.assertEqual(numeric.syllables_array(['']), [0])
+        self.assertEqual(numeric.syllables_array(['', '']), [0, 0])
+        self.assertEqual(numeric.syllables_array([]), [])
+
+    def test_matches_syllables(self):
+        """Every count matches the original's, word for word."""
+        words = numeric_words(WORDS)
+        expected = [translator.syllables(x) for x in words]
+        counted = numeric.syllables_array(words)
+        mismatches = [(x, y, z) for x, y, z in zip(words, expected, counted)
+                      if y != z]
+        self.assertEqual(mismatches, [])
+        self.assertIsInstance(counted, list)
+
+
+if __name__ == '__main__':
+    unittest.main()
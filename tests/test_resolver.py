@@ -0,0 +1,128 @@
+"""
+"""
+import http.server
+import threading
+import time
+import unittest
+from martiandtrump import resolver
+
+
+class StandInHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Answers like a link shortener: redirecting, stalling, or refusing HEAD.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    def answer(self):
+        """Respond to a request by what its path asks for."""
+        self.server.requests.append((self.command, self.path))
+        if '/wait/' in self.path:
+            time.sleep(float(self.path.rsplit('/', 1)[1]))
+        if self.path.startswith('/to/'):
+            self.reply(301, '/' + self.path[4:])
+        elif self.path == '/nohead' and self.command == 'HEAD':
+            self.reply(405)
+        elif self.path == '/nohead':
+            self.reply(302, '/done')
+        else:
+            self.reply(200)
+
+    def do_GET(self):
+        """Answer a GET."""
+        self.answer()
+
+    def do_HEAD(self):
+        """Answer a HEAD."""
+        self.answer()
+
+    def log_message(self, *args):
+        """Keep quiet."""
+
+    def reply(self, status, location=None):
+        """Send a bodiless response, redirecting if there's a location."""
+        self.send_response(status)
+        if location:
+            self.send_header('Location', location)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+
+class URLResolverTest(unittest.TestCase):
+    """
+    Resolves links against a local stand-in server instead of the internet.
+    """
+
+    @classmethod
+    def setUpClass(cls):
+        """Start the stand-in server on a free port."""
+        cls.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                     StandInHandler)
+        cls.server.daemon_threads = True
+        cls.server.requests = []
+        cls.base = 'http://127.0.0.1:' + str(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def tearDownClass(cls):
+        """Stop the stand-in server."""
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setUp(self):
+        """Start each test with a fresh resolver."""
+        self.server.requests[:] = []
+        self.resolver = resolver.URLResolver(deadline=1, retry=60)
+
+    def tearDown(self):
+        """Close the resolver."""
+        self.resolver.close()
+
+    def test_cached(self):
+        """A link is only followed once, and checking it counts nothing."""
+        url = self.base + '/to/done'
+        self.assertEqual(self.resolver.resolve(url), self.base + '/done')
+        self.assertEqual(self.resolver.resolve(url), self.base + '/done')
+        for _ in range(3):
+            self.assertTrue(self.resolver.settled(url))
+        stats = self.resolver.cache.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(len(self.server.requests), 2)
+
+    def test_concurrent(self):
+        """Links in one tweet are followed at the same time."""
+        urls = [self.base + '/' + str(x) + '/wait/0.3' for x in range(4)]
+        self.assertIsNone(self.resolver.workers)
+        began = time.monotonic()
+        resolved = self.resolver.resolve_many(urls)
+        self.assertLess(time.monotonic() - began, 1.0)
+        self.assertEqual(resolved, {x: x for x in urls})
+
+    def test_deadline(self):
+        """A stalling link is left as it is, and not settled."""
+        url = self.base + '/wait/3'
+        began = time.monotonic()
+        self.assertEqual(self.resolver.resolve(url), url)
+        self.assertLess(time.monotonic() - began, 2.0)
+        self.assertFalse(self.resolver.settled(url))
+
+    def test_head_first(self):
+        """Redirects are followed by HEAD, falling back to GET if refused."""
+        self.resolver.resolve(self.base + '/to/to/nohead')
+        self.assertEqual(self.server.requests, [
+            ('HEAD', '/to/to/nohead'),
+            ('HEAD', '/to/nohead'),
+            ('HEAD', '/nohead'),
+            ('GET', '/nohead'),
+            ('HEAD', '/done'),
+        ])
+
+    def test_lazy_workers(self):
+        """Worker threads don't start until several links need following."""
+        self.resolver.resolve(self.base + '/done')
+        self.resolver.resolve_many([self.base + '/done'])
+        self.assertIsNone(self.resolver.workers)
+
+
+if __name__ == '__main__':
+    unittest.main()